@@ -0,0 +1,226 @@
+"""
+Microbenchmarks for the per-sample pipeline stages:
+1. FaceEstimator detection (dlib HOG frontal face detector)
+2. landmark prediction (dlib shape_predictor)
+3. Face.fit with and without crop_eye
+4. Eye construction (one fixed-size patch warp per eye) and batched eye patch extraction of 32 eyes
+5. Face.save in each output format ('files', 'shards', 'async')
+   and the resident memory retained per fitted Face (as held by AsyncSaver queues or batch reprocessing)
+6. detector backend selection (lib.detectors.calibrate), only with --frames since synthetic frames contain no face
+
+Frames are synthetic (or given with --frames) at several resolutions. dlib stages are skipped when dlib or
+shape_predictor_68_face_landmarks.dat are not available. Latency percentiles (p50/p95/p99) and peak traced memory
+of every stage are written as JSON, so results can be compared between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import prep_directory
+from lib import detectors
+from lib.eye import Eye, extract_eye_patches
+from lib.face import Face
+from lib.saver import AsyncSaver
+from lib.shards import ShardWriter
+
+MODEL_PATH = "shape_predictor_68_face_landmarks.dat"
+RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+
+
+def synthetic_landmarks(boundingbox):
+    """Rough 68-point layout (jaw, brows, nose, eyes, mouth) inside boundingbox [(left, top), (right, bottom)]"""
+    (left, top), (right, bottom) = boundingbox
+    w, h = right - left, bottom - top
+
+    def ellipse(cx, cy, rx, ry, start, stop, n):
+        t = np.linspace(start, stop, n)
+        return np.stack([cx + rx * np.cos(t), cy + ry * np.sin(t)], axis=1)
+
+    jaw = np.stack([np.linspace(0.05, 0.95, 17), 0.45 + 0.5 * np.sin(np.linspace(0, np.pi, 17))], axis=1) # left ear -> chin -> right ear
+    brows = np.concatenate([np.stack([np.linspace(0.15, 0.4, 5), np.full(5, 0.25)], axis=1),
+                            np.stack([np.linspace(0.6, 0.85, 5), np.full(5, 0.25)], axis=1)])
+    nose = np.concatenate([np.stack([np.full(4, 0.5), np.linspace(0.35, 0.55, 4)], axis=1),
+                           np.stack([np.linspace(0.4, 0.6, 5), np.full(5, 0.6)], axis=1)])
+    eye_template = [(-1, 0), (-0.5, -0.5), (0.5, -0.5), (1, 0), (0.5, 0.5), (-0.5, 0.5)]
+    eyes = np.concatenate([np.array(eye_template) * [0.08, 0.06] + center for center in ((0.3, 0.38), (0.7, 0.38))])
+    mouth = np.concatenate([ellipse(0.5, 0.75, 0.15, 0.06, np.pi, -np.pi, 13)[:12], ellipse(0.5, 0.75, 0.1, 0.03, np.pi, -np.pi, 9)[:8]])
+    points = np.concatenate([jaw, brows, nose, eyes, mouth])
+    return (points * [w, h] + [left, top]).astype(int)
+
+
+def synthetic_frame(width, height, rng):
+    """Noisy frame with a face-like drawing in the middle. Returns (frame, boundingbox, landmarks)"""
+    frame = rng.integers(0, 64, size=(height, width, 3), dtype=np.uint8)
+    size = min(width, height) // 2
+    left, top = (width - size) // 2, (height - size) // 2
+    boundingbox = [(left, top), (left + size, top + size)]
+    landmarks = synthetic_landmarks(boundingbox)
+    cv2.ellipse(frame, (width // 2, height // 2), (size // 2, int(size * 0.6)), 0, 0, 360, (150, 170, 200), -1)
+    for point in landmarks:
+        cv2.circle(frame, (int(point[0]), int(point[1])), 2, (40, 40, 40), -1)
+    return frame, boundingbox, landmarks
+
+
+def load_frame(path, width, height):
+    frame = cv2.resize(cv2.imread(path), (width, height))
+    return frame, None, None
+
+
+def measure(fn, setup=lambda: (), repeats=30, warmup=3):
+    """Time fn(*setup()) repeats times (setup is not timed), then trace its peak memory once"""
+    for _ in range(warmup):
+        fn(*setup())
+    samples = []
+    for _ in range(repeats):
+        args = setup()
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples = np.array(samples) * 1000
+    return {'p50_ms': float(np.percentile(samples, 50)), 'p95_ms': float(np.percentile(samples, 95)),
+            'p99_ms': float(np.percentile(samples, 99)), 'mean_ms': float(samples.mean()),
+            'peak_mem_kb': peak / 1024, 'repeats': repeats}
+
+
+def measure_retained(factory, count=64):
+    """Traced memory retained per object while count objects built by factory() are alive, plus the size of the
+       bare Python objects (Face/Eye instances without their arrays)"""
+    objects = []
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    for _ in range(count):
+        objects.append(factory())
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    face = objects[0]
+    object_bytes = sys.getsizeof(face) + sum(sys.getsizeof(eye) for eye in face.eyes or [])
+    return {'retained_kb_per_sample': (current - baseline) / count / 1024, 'object_bytes_per_sample': object_bytes, 'count': count}
+
+
+def _load_dlib():
+    try:
+        import dlib
+    except ImportError:
+        return None, None
+    predictor = dlib.shape_predictor(MODEL_PATH) if os.path.exists(MODEL_PATH) else None
+    return dlib, predictor
+
+
+def bench_resolution(frame, boundingbox, landmarks, repeats, workdir, dlib, predictor):
+    results = {}
+    skipped = []
+    if dlib is not None:
+        detector = dlib.get_frontal_face_detector()
+        results['detection'] = measure(lambda: detector(frame), repeats=repeats)
+        if predictor is not None:
+            if boundingbox is None: # real frames: use the detected face and predicted landmarks for the later stages
+                faces = detector(frame)
+                if len(faces) == 1:
+                    shape = predictor(frame, faces[0])
+                    landmarks = np.array([(p.x, p.y) for p in shape.parts()])
+                    boundingbox = [(faces[0].left(), faces[0].top()), (faces[0].right(), faces[0].bottom())]
+            if boundingbox is not None:
+                rect = dlib.rectangle(boundingbox[0][0], boundingbox[0][1], boundingbox[1][0], boundingbox[1][1])
+                results['landmark_prediction'] = measure(lambda: predictor(frame, rect), repeats=repeats)
+        else:
+            skipped.append(f'landmark_prediction ({MODEL_PATH} not found)')
+    else:
+        skipped += ['detection (dlib not installed)', 'landmark_prediction (dlib not installed)']
+
+    if landmarks is None:
+        skipped.append('fit/eye/save (no face found on frame)')
+        return results, skipped
+
+    new_face = lambda: (Face(frame, boundingbox, landmarks, gazepoint=(0, 0)),)
+    results['fit'] = measure(lambda face: face.fit(), new_face, repeats=repeats)
+    results['fit_crop_eye'] = measure(lambda face: face.fit(crop_eye=True), new_face, repeats=repeats)
+    face_landmarks = new_face()[0].landmarks
+    results['eye'] = measure(lambda: (Eye(frame, face_landmarks[27:33]), Eye(frame, face_landmarks[33:40])), repeats=repeats)
+    eye_landmarks = np.repeat(np.stack([face_landmarks[27:33], face_landmarks[33:39]]), 16, axis=0) # both eyes of 16 faces
+    results['eye_patches_batch32'] = measure(lambda: extract_eye_patches(frame, eye_landmarks), repeats=repeats)
+
+    def fitted_face():
+        face = Face(frame, boundingbox, landmarks, gazepoint=(0, 0))
+        face.fit(crop_eye=True)
+        return (face,)
+
+    results['retained_face'] = measure_retained(lambda: fitted_face()[0])
+
+    counter = iter(range(10 ** 9))
+    prep_directory.main(workdir)
+    base = os.path.join(workdir, 'data')
+    results['save_files'] = measure(lambda face: face.save(f'bench_{next(counter)}', base=base), fitted_face, repeats=repeats)
+    with ShardWriter(os.path.join(base, 'shards'), shard_size=max(repeats, 1)) as writer:
+        results['save_shards'] = measure(lambda face: face.save(f'bench_{next(counter)}', writer=writer), fitted_face, repeats=repeats)
+    with AsyncSaver() as saver: # latency seen by the acquisition loop, i.e. the time to hand off a sample
+        results['save_async'] = measure(lambda face: saver.submit(face, f'bench_{next(counter)}', base=base), fitted_face, repeats=repeats)
+    return results, skipped
+
+
+def _environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'opencv': cv2.__version__}
+
+
+def main(output='bench_output.json', repeats=30, resolutions=RESOLUTIONS, frames=None, seed=0):
+    rng = np.random.default_rng(seed)
+    dlib, predictor = _load_dlib()
+    report = {'environment': _environment(), 'results': {}}
+    sources = frames or [None]
+    with tempfile.TemporaryDirectory() as workdir:
+        for width, height in resolutions:
+            for source in sources:
+                frame, boundingbox, landmarks = synthetic_frame(width, height, rng) if source is None else load_frame(source, width, height)
+                key = f'{width}x{height}' + ('' if source is None else f':{os.path.basename(source)}')
+                results, skipped = bench_resolution(frame, boundingbox, landmarks, repeats, workdir, dlib, predictor)
+                report['results'][key] = {'stages': results, 'skipped': skipped}
+                for stage, stats in results.items():
+                    if 'retained_kb_per_sample' in stats:
+                        print(f"{key:>12} {stage:<20} {stats['retained_kb_per_sample']:10.1f} KiB retained per sample  ({stats['object_bytes_per_sample']} B Python objects)")
+                        continue
+                    print(f"{key:>12} {stage:<20} p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms  peak {stats['peak_mem_kb']:10.1f} KiB")
+                for stage in skipped:
+                    print(f"{key:>12} skipped {stage}")
+
+    if frames and dlib is not None:
+        width, height = resolutions[0]
+        selected, _, backends = detectors.calibrate([load_frame(source, width, height)[0] for source in frames])
+        report['detector_selection'] = {'resolution': f'{width}x{height}', 'selected': selected, 'backends': backends}
+        for name, stats in backends.items():
+            print(f"detector {name:<10} {stats}")
+        print(f"Selected detector: {selected}")
+
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the per-sample pipeline stages")
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--repeats', type=int, default=30)
+    parser.add_argument('--resolutions', nargs='+', default=[f'{w}x{h}' for w, h in RESOLUTIONS])
+    parser.add_argument('--frames', nargs='+', default=None, help="face images to use instead of synthetic frames")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    resolutions = [tuple(int(v) for v in resolution.split('x')) for resolution in args.resolutions]
+    main(args.output, args.repeats, resolutions, args.frames, args.seed)
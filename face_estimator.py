@@ -1,42 +1,228 @@
-import dlib
 import os
-import cv2
+import threading
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
 from typing import List, Tuple
-from lib.face import Face
+from lib import metrics
 
+# Imported on first use by _import_dependencies(): dlib alone is a noticeable part of startup time, and cv2,
+# lib.face and lib.detectors are only needed once a FaceEstimator is built (usually on the background loader)
+dlib = cv2 = Face = detectors = None
+_estimator = None # process-wide FaceEstimator, a Future while it is being loaded
+_estimator_kwargs = None # configuration the process-wide FaceEstimator was loaded with
+_estimator_lock = threading.Lock()
+
+
+def _import_dependencies():
+    global dlib, cv2, Face, detectors
+    if dlib is None:
+        import cv2 as _cv2
+        import dlib as _dlib
+        from lib import detectors as _detectors
+        from lib.face import Face as _Face
+        cv2, Face, detectors = _cv2, _Face, _detectors
+        dlib = _dlib # set last, it marks the imports as done
+    return dlib
+
+
+def load_estimator_async(**kwargs) -> Future:
+    """Start loading the process-wide FaceEstimator on a background thread (no-op if already started).
+       The returned Future doubles as the readiness signal: done() once the models are loaded.
+       Raises ValueError if kwargs differ from the configuration the estimator was already loaded with."""
+    global _estimator, _estimator_kwargs
+    with _estimator_lock:
+        if _estimator is not None and kwargs and kwargs != _estimator_kwargs:
+            raise ValueError(f"FaceEstimator was already loaded with {_estimator_kwargs}, not {kwargs}")
+        if _estimator is None:
+            _estimator, _estimator_kwargs = Future(), kwargs
+            future = _estimator
+
+            def load():
+                try:
+                    future.set_result(FaceEstimator(**kwargs))
+                except Exception as e:
+                    future.set_exception(e)
+            threading.Thread(target=load, daemon=True).start()
+        return _estimator
+
+
+def estimator_ready():
+    return _estimator is not None and _estimator.done()
+
+
+def get_estimator(timeout=None, **kwargs):
+    """Return the process-wide FaceEstimator, loading it (or waiting for a background load) if needed.
+       Without kwargs the estimator is returned as loaded; with kwargs they must match its configuration"""
+    return load_estimator_async(**kwargs).result(timeout=timeout)
 
 
 class FaceEstimator():
-    """Create estimator object for detecting face in a frame and landmark coordinates"""
-    def __init__(self):
+    """Create estimator object for detecting face in a frame and landmark coordinates
+
+       If tracking is enabled, inspect() takes a fast path meant for live previews:
+       1. the face is detected on a downscaled grayscale frame
+       2. once a face is found, later detections only search a margin around the last boundingbox
+       3. between keyframes, landmarks are propagated with pyramidal Lucas-Kanade optical flow instead of shape_predictor
+       4. whenever the flow loses too many points (or the ROI search fails) a full detection is performed again
+
+       detector is a backend name from lib.detectors.BACKENDS or a detector instance (see calibrate_detector()).
+    """
+    def __init__(self, tracking=False, downscale=0.5, roi_margin=0.5, keyframe_interval=10, min_track_ratio=0.8, max_flow_error=1.0, detector='hog'):
         model_path = "shape_predictor_68_face_landmarks.dat"
-        self._face_detector = dlib.get_frontal_face_detector()
-        self._landmark_predictor = dlib.shape_predictor(model_path) 
+        _import_dependencies()
+        self.use_detector(detector)
+        self._landmark_predictor = dlib.shape_predictor(model_path)
         self.face = None
-    
-    def inspect(self, frame) -> List:
-        """Inspect if a face can be detected and return a Face object, else returns None"""
-        face_candidates = self._face_detector(frame)
+
+        # Tracking parameters
+        self.tracking = tracking
+        self.downscale = downscale # scale factor of the frame the detector runs on
+        self.roi_margin = roi_margin # margin around the last boundingbox to search, relative to its size
+        self.keyframe_interval = keyframe_interval # maximum number of frames landmarks are propagated by optical flow
+        self.min_track_ratio = min_track_ratio # minimum fraction of landmarks that must be tracked reliably
+        self.max_flow_error = max_flow_error # maximum forward-backward flow error in pixels for a point to count as tracked
+        self._reset_tracking()
+
+        # Per-frame latency of inspect() in seconds
+        self.latency = None
+        self.latency_history = deque(maxlen=120)
+        self.last_mode = None # 'full', 'roi' or 'flow' (which path produced the last result)
+        self.last_count = None # number of face candidates found by the last detection
+
+    def use_detector(self, detector):
+        """Swap the face detector backend, by name or instance. The landmark predictor is unaffected"""
+        self._detector = detectors.make_detector(detector) if isinstance(detector, str) else detector
+        self.detector_name = getattr(self._detector, 'name', type(self._detector).__name__)
+
+    def calibrate_detector(self, frames, backends=None, min_agreement=0.9, min_iou=0.4, min_faces=10):
+        """Benchmark the detector backends on sample frames against the HOG reference and switch to
+           the fastest one that agrees on at least min_agreement of the frames. Falls back to HOG unless the
+           reference found a face on at least min_faces frames. Returns the per-backend report"""
+        _, detector, report = detectors.calibrate(frames, backends, min_agreement=min_agreement, min_iou=min_iou, min_faces=min_faces)
+        self.use_detector(detector)
+        self._reset_tracking()
+        return report
+
+    def _reset_tracking(self):
+        self._prev_gray = None
+        self._prev_points = None # (68, 1, 2) float32 landmark coordinates on the previous frame
+        self._prev_box = None # (left, top, right, bottom) on the previous frame
+        self._frames_since_keyframe = 0
+
+    @metrics.timed('inspect')
+    def inspect(self, frame, track=None) -> List:
+        """Inspect if a face can be detected and return a Face object, else returns None
+           track overrides the tracking mode set at initialization for this call.
+        """
+        start = time.perf_counter()
+        if self.tracking if track is None else track:
+            face = self._inspect_tracked(frame)
+        else:
+            face = self._inspect_full(frame)
+        self.latency = time.perf_counter() - start
+        self.latency_history.append(self.latency)
+        return face
+
+    def _inspect_full(self, frame):
+        self.last_mode = 'full'
+        face_candidates = self._detector(frame)
+        self.last_count = len(face_candidates)
         if len(face_candidates) == 1:
-            boundingbox = face_candidates[0] # returns dlib rectangle object
-            landmarks = self._landmark_predictor(frame, boundingbox)
+            left, top, right, bottom = face_candidates[0]
+            landmarks = self._landmark_predictor(frame, dlib.rectangle(left, top, right, bottom))
+
+            # Convert dlib's object type into a (68, 2) int array
+            landmarks = np.array([(point.x, point.y) for point in landmarks.parts()], dtype=int)
+            boundingbox = [(left, top), (right, bottom)]
 
-            # Convert dlib's object type into native python types. Into List[Tuple[int, int]]
-            landmarks = [(landmarks.part(n).x, landmarks.part(n).y) for n in range(0, 68)]
-            boundingbox = [(boundingbox.left(), boundingbox.top()), (boundingbox.right(), boundingbox.bottom())]
-            
             return Face(frame, boundingbox, landmarks)
         else:
             return None
-            
-        
 
-        
-             
+    def predict(self, frame, boundingbox):
+        """Run only the landmark predictor inside a known boundingbox [(left, top), (right, bottom)] and return a Face"""
+        (left, top), (right, bottom) = boundingbox
+        landmarks = self._landmark_predictor(frame, dlib.rectangle(int(left), int(top), int(right), int(bottom)))
+        landmarks = np.array([(point.x, point.y) for point in landmarks.parts()], dtype=int)
+        return Face(frame, boundingbox, landmarks)
+
+    def _inspect_tracked(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        points, box = None, None
+        if self._prev_points is not None and self._frames_since_keyframe < self.keyframe_interval:
+            points, box = self._track_landmarks(gray)
+
+        if points is None: # Keyframe: detect and run the landmark predictor
+            box = self._detect(gray)
+            if box is None:
+                self._reset_tracking()
+                return None
+            shape = self._landmark_predictor(gray, dlib.rectangle(*box))
+            points = np.array([(p.x, p.y) for p in shape.parts()], dtype=np.float32).reshape(-1, 1, 2)
+            self._frames_since_keyframe = 0
+        else:
+            self.last_mode = 'flow'
+            self.last_count = 1
+            self._frames_since_keyframe += 1
+
+        self._prev_gray, self._prev_points, self._prev_box = gray, points, box
+        landmarks = np.rint(points.reshape(-1, 2)).astype(int)
+        boundingbox = [(box[0], box[1]), (box[2], box[3])]
+        return Face(frame, boundingbox, landmarks)
 
+    def _detect(self, gray):
+        """Detect a single face on a downscaled frame, searching around the last boundingbox first"""
+        if self._prev_box is not None:
+            left, top, right, bottom = self._prev_box
+            mx, my = int((right - left) * self.roi_margin), int((bottom - top) * self.roi_margin)
+            x0, y0 = max(left - mx, 0), max(top - my, 0)
+            x1, y1 = min(right + mx, gray.shape[1]), min(bottom + my, gray.shape[0])
+            if x1 > x0 and y1 > y0:
+                box = self._detect_scaled(gray[y0:y1, x0:x1])
+                if box is not None:
+                    self.last_mode = 'roi'
+                    return (box[0] + x0, box[1] + y0, box[2] + x0, box[3] + y0)
+        self.last_mode = 'full'
+        return self._detect_scaled(gray)
 
-    
+    def _detect_scaled(self, gray):
+        """Detect on a downscaled frame, falling back to full resolution when nothing is found there
+           (faces smaller than the detector window over downscale are invisible on the small frame).
+           Backends that already downscale internally (e.g. 'hog_half') are not downscaled a second time."""
+        scale = self.downscale if getattr(self._detector, 'scale', 1.0) == 1.0 else 1.0
+        face_candidates = []
+        if scale != 1:
+            small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            face_candidates = self._detector(small)
+        if not face_candidates:
+            scale = 1.0
+            face_candidates = self._detector(gray)
+        self.last_count = len(face_candidates)
+        if len(face_candidates) != 1:
+            return None
+        return tuple(int(round(v / scale)) for v in face_candidates[0])
 
-        
+    def _track_landmarks(self, gray):
+        """Propagate the previous landmarks with forward-backward checked pyramidal LK flow.
+           Returns (None, None) when too few points could be tracked reliably."""
+        lk_params = dict(winSize=(21, 21), maxLevel=3, criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+        forward, status_fw, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, self._prev_points, None, **lk_params)
+        backward, status_bw, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, forward, None, **lk_params)
+        error = np.linalg.norm((backward - self._prev_points).reshape(-1, 2), axis=1)
+        good = (status_fw.ravel() == 1) & (status_bw.ravel() == 1) & (error < self.max_flow_error)
+        if good.mean() < self.min_track_ratio:
+            return None, None
 
+        # Unreliable points follow the median motion of the reliable ones
+        displacement = (forward - self._prev_points).reshape(-1, 2)
+        shift = np.median(displacement[good], axis=0)
+        points = np.where(good[:, None], forward.reshape(-1, 2), self._prev_points.reshape(-1, 2) + shift)
+        dx, dy = (int(round(v)) for v in shift)
+        left, top, right, bottom = self._prev_box
+        return points.astype(np.float32).reshape(-1, 1, 2), (left + dx, top + dy, right + dx, bottom + dy)
 
+    def mean_latency(self):
+        """Average inspect() latency in seconds over the recent frames"""
+        return sum(self.latency_history) / len(self.latency_history) if self.latency_history else None
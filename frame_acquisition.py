@@ -6,102 +6,285 @@ while performing either:
 
 Set 'mode' parameter to 'calibration' or 'stream' to use respective utilities
 default is 'calibration'
+
+The calibration sequence takes its frame source, display/key input and notifier as arguments,
+so it can also run headless over a recorded video with scripted keys (see replay.py)
 """
-from face_estimator import FaceEstimator
-from lib.face import Face
-from lib.eye import Eye
+from face_estimator import load_estimator_async, estimator_ready, get_estimator
+from lib.capture import FrameGrabber
+from lib.saver import AsyncSaver
+from lib.shards import ShardWriter
+from lib import metrics
+from lib.scheduler import make_scheduler, load_progress, record_progress
+from lib.preprocessing import sharpness
+from lib.presentation import Display, LatencyTracker, make_notifier
 from lib.configs import *
 import cv2
 import numpy as np
 import os
-import winsound
-from collections import deque
+import time
 from datetime import datetime
 
 
 
-def main(applicant_name, screen_width=1920, screen_height=1080):
+def _best_of_burst(estimator, face, frames):
+    """Pick the candidate with the best EAR x eye sharpness score among the detected face and the burst frames"""
+    candidates = [face] + [estimator.predict(frame, face.boundingbox) for frame in frames]
+    score = lambda candidate: candidate.eye_aspect_ratio() * sharpness(candidate.frame, candidate.landmarks[27:39])
+    return max(candidates, key=score)
+
+
+def _record_when_saved(progress_path, point):
+    """Save future callback: add point to the progress file only once its sample was written, so a resumed
+       session retries the points whose save failed"""
+    def record(future):
+        if not future.cancelled() and future.exception() is None:
+            record_progress(progress_path, point)
+    return record
+
+
+def main(applicant_name, screen_width=1920, screen_height=1080, async_save=True, output_format='files', mode='calibration', duration=10,
+         metrics_path=None, scheduler='grid', resume=False, burst=False, burst_before=2, burst_after=2,
+         manifest=False, session=None, max_capture_lag=0.05, detector='hog', source=None, display=None, notifier='auto',
+         base='./data', **scheduler_kwargs):
+    """source is a started or unstarted frame source (FrameGrabber, VideoReplay) or a camera index/video path,
+       display a Display or HeadlessDisplay, notifier a notifier object or make_notifier() kind.
+       Returns a summary of the calibration session"""
+    # Mode-specific modules are imported where they are used to keep startup fast
+    if mode == 'stream':
+        from lib.stream import run_stream
+        current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
+        summary = run_stream(get_estimator(), '_'.join([current_time, applicant_name]), duration=duration)
+        print(summary)
+        return summary
+    if mode == 'pipeline': # continuous capture with full processing, one process per stage
+        from lib.pipeline import Pipeline
+        current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
+        with Pipeline(prefix='_'.join([current_time, applicant_name])) as pipeline:
+            start = time.monotonic()
+            while time.monotonic() - start < duration:
+                time.sleep(1.0)
+                stats = pipeline.stats()
+                print(stats)
+                if stats['failed_stages']: # a dead stage stalls the others, stop instead of reporting zeros
+                    break
+        summary = pipeline.close()
+        print(summary)
+        return summary
+
     dot_radius = 4  # Radius of the dot
     instructions = "Press 'x' to start calibration sequence"  # User instructions
     instruction_image = np.zeros((screen_height, screen_width, 3), dtype=np.uint8)
-    base_image = np.zeros((screen_height, screen_width, 3), dtype=np.uint8)
+    display = display or Display()
+    notifier = make_notifier(notifier) if isinstance(notifier, str) else notifier
+
+    # Load the face models in the background while the instructions are shown
+    load_estimator_async()
 
     # Display user instructions in a pop-up window
-    cv2.namedWindow("Instructions", cv2.WINDOW_NORMAL)
-    cv2.setWindowProperty("Instructions", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
     cv2.putText(instruction_image, instructions, (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-    cv2.imshow("Instructions", instruction_image)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
-    
-    cap = cv2.VideoCapture(0) # initialize webcam
-    estimator = FaceEstimator()
+    display.show("Instructions", instruction_image, fullscreen=True)
+    display.wait_key(0)
+    dismissed = time.monotonic()
+    # initialize webcam on a background capture thread (or the given frame source)
+    cap = (source if source is not None and not isinstance(source, (int, str)) else FrameGrabber(source or 0)).start()
+    if not estimator_ready():
+        cv2.putText(instruction_image, "Loading face models...", (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        display.show("Instructions", instruction_image)
+        while not estimator_ready():
+            display.idle(30)
+    display.close()
+    estimator = get_estimator()
+    if detector not in ('auto', estimator.detector_name):
+        estimator.use_detector(detector)
 
     # Display current media input
     message = "Adjust your face to be at the center of the screen. Do not move until the calibration is over. Press Enter to continue"
     while True:
-        _, frame = cap.read()
+        frame, _ = cap.read(wait_new=True) # wait for a new frame so the preview isn't redrawn with duplicates
+        if frame is None: # source ended, or no new frame within the timeout
+            if cap.running:
+                continue
+            break
         cv2.putText(frame, message, (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        face = estimator.inspect(frame) # detect face
+        face = estimator.inspect(frame, track=True) # detect face with the tracking fast path
         if face:
             cv2.rectangle(frame, face.boundingbox[0], face.boundingbox[1], (0, 255, 0), 2)
+        latency = estimator.mean_latency()
+        cv2.putText(frame, f"inspect: {latency * 1000:.1f} ms ({1 / latency:.0f} fps, {estimator.last_mode})", (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
         
-        cv2.imshow("Current Media Input", frame)
-        if cv2.waitKey(1) == 13:
+        display.show("Current Media Input", frame)
+        if dismissed is not None:
+            print(f"Time to first preview frame: {(time.monotonic() - dismissed) * 1000:.0f} ms")
+            dismissed = None
+        if display.wait_key(1)[0] == 13:
             break
 
+    if detector == 'auto': # pick the fastest detector backend that agrees with HOG, now that the participant is in frame
+        report = estimator.calibrate_detector([cap.read(wait_new=True)[0] for _ in range(30)])
+        print(f"Selected detector: {estimator.detector_name} {report}")
+
     
-    # Prepare a grid of gaze points
-    gap = 10
-    points = [(x, y) for x in range(0, screen_width, gap) for y in range(0, screen_height, gap)]
-    queue = deque()
-    np.random.shuffle(points)  # Shuffle the points
-    
-    # Append all gaze points to the queue 
-    for point in points:
-        queue.append(point)
+    # Prepare the gaze point scheduler ('grid' is the dense shuffled grid, 'coverage' stops once the screen is covered)
+    if isinstance(scheduler, str):
+        scheduler = make_scheduler(scheduler, screen_width, screen_height, **scheduler_kwargs)
+    progress_path = os.path.join(base, 'sessions', f'{applicant_name}_{type(scheduler).__name__}.jsonl')
+    os.makedirs(os.path.dirname(progress_path), exist_ok=True)
+    # Optional SQLite manifest of every saved sample. Pass the session id of an interrupted session to resume it
+    session = session or '_'.join([applicant_name, datetime.now().strftime('%Y%m%d_%H%M%S')])
+    if manifest:
+        from lib.manifest import Manifest
+        manifest = Manifest(os.path.join(base, 'manifest.sqlite'), applicant=applicant_name, session=session)
+    else:
+        manifest = None
+    if resume and manifest: # rebuild the remaining gaze points from the samples completed in this session
+        scheduler.resume(manifest.completed_points())
+    elif resume: # skip gaze points accepted in a previous run of this session
+        scheduler.resume(load_progress(progress_path))
+    elif os.path.exists(progress_path): # keep a partial session that was started without resume instead of discarding it
+        backup_path = progress_path.replace('.jsonl', f"_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+        os.replace(progress_path, backup_path)
+        print(f"Warning: existing progress for {applicant_name} moved to {backup_path}. Pass resume=True to continue a session")
     
+    # Samples are written by background workers so the next dot appears without waiting on disk I/O
+    saver = AsyncSaver(on_error=lambda filename, e: print(f"Failed to save {filename}: {e}")) if async_save else None
+    # 'shards' appends uint8 samples into a few large files instead of ten small files per sample
+    writer = ShardWriter(os.path.join(base, 'shards')) if output_format == 'shards' else None
+
+    # Opt-in per-sample stage timings and reject reasons (.jsonl or .csv)
+    recorder = metrics.enable(metrics_path) if metrics_path else None
+    requeues = {} # gazepoint -> number of times it was rejected and rescheduled
+
+    # Window is created once, only the old and new dot regions are redrawn between stimuli
+    window = display.stimulus("Calibration", screen_width, screen_height, dot_radius=dot_radius)
+    latencies = LatencyTracker(max_capture_lag=max_capture_lag)
+
     instance_num = 0
-    while queue:
-        # Randomly generate dot coordinates
-        dot_x, dot_y = queue.popleft() 
-         # Draw a red dot on the blank image
-        dot_color = (0, 0, 255)  # Full red color
-        dot_image = cv2.circle(base_image, (dot_x, dot_y), dot_radius, dot_color, -1)
-
-        # Show blank image with red dot fullscreen
-        cv2.namedWindow("Calibration", cv2.WINDOW_NORMAL)
-        cv2.setWindowProperty("Calibration", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
-        cv2.imshow("Calibration", dot_image)
+    rejected = 0
+    started = time.monotonic()
+    try:
+        while (point := scheduler.next()) is not None:
+            # Next dot coordinates
+            dot_x, dot_y = point
+            # Show red dot fullscreen, with the live metrics overlay if enabled
+            onset = window.show_dot(point, recorder.summary_lines() if recorder else None)
         
-        # Wait for key press
-        key = cv2.waitKey(0) & 0xFF
-        if key == 13:  # 13 is the ASCII code for Enter key
-            _, frame = cap.read()
-            face = estimator.inspect(frame) # detect face
-            face.gazepoint = (dot_x, dot_y)
-            if face:
-                face.fit(crop_eye=True) # fit face
-                # calculate average EAR
-                avg_EAR = (face.eyes[0].EAR + face.eyes[1].EAR) / 2
-                if avg_EAR >= MINIMUM_EAR: # If eyes are open
-                    instance_num += 1
-                    current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = '_'.join([current_time, applicant_name, str(instance_num)])
-                    face.save(filename) # save face object
-                    winsound.Beep(1000, 500) # Notification
-                    print(filename)
+            # Wait for key press
+            key, keypress = window.wait_key()
+            if key == 13:  # 13 is the ASCII code for Enter key
+                metrics.begin_sample(point, requeues.get(point, 0))
+                with metrics.stage('capture'):
+                    if burst:
+                        burst_frames, keypress_index = cap.read_burst(before=burst_before, after=burst_after) # frames around the keypress
+                        frames = [frame for frame, _ in burst_frames]
+                        frame, frame_time = burst_frames[keypress_index] if keypress_index is not None else (None, None) # the one captured at the keypress
+                    else:
+                        frame, frame_time = cap.read() # newest frame, no waiting on the driver buffer
+                if frame is None: # source ended
+                    metrics.end_sample('aborted', 'no_frame')
+                    break
+                face = estimator.inspect(frame) # detect face
+                reason = None
+                if face:
+                    if burst: # landmarks on the other burst frames reuse the detected boundingbox
+                        face = _best_of_burst(estimator, face, [other for other in frames if other is not frame])
+                        frame_time = next(timestamp for candidate, timestamp in burst_frames if candidate is face.frame)
+                    face.gazepoint = (dot_x, dot_y)
+                    face.timing = latencies.record(onset, keypress, frame_time) # stored alongside the gazepoint
+                    with metrics.stage('ear_gate'):
+                        # calculate average EAR from the landmarks, before spending any work on cropping
+                        avg_EAR = face.eye_aspect_ratio()
+                    if avg_EAR >= MINIMUM_EAR: # If eyes are open
+                        try:
+                            face.fit(crop_eye=True) # fit face
+                        except ValueError:
+                            reason = 'fit_error'
+                        if not reason:
+                            instance_num += 1
+                            current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
+                            filename = '_'.join([current_time, applicant_name, str(instance_num)])
+                            if saver:
+                                future = saver.submit(face, filename, base=base, writer=writer, manifest=manifest) # queue face object for saving
+                                future.add_done_callback(_record_when_saved(progress_path, point))
+                            else:
+                                face.save(filename, base=base, writer=writer, manifest=manifest) # save face object
+                                record_progress(progress_path, point)
+                            metrics.end_sample('accepted', sample=filename)
+                            scheduler.report(point, accepted=True)
+                            notifier.notify()
+                            print(filename if not saver else f"{filename} (save queue depth: {saver.depth})")
+                    else:
+                        reason = 'eyes_closed'
                 else:
-                    queue.append((dot_x, dot_y))
-                    
+                    reason = 'no_face' if not estimator.last_count else 'multiple_faces'
+
+                if reason:
+                    rejected += 1
+                    metrics.end_sample('rejected', reason)
+                    requeues[point] = requeues.get(point, 0) + 1
+                    scheduler.report(point, accepted=False)
             else:
-                queue.append((dot_x, dot_y))
-        else:
-            cap.release()
-            cv2.destroyAllWindows()
-            break
-        base_image.fill(0)
+                break
+    finally: # also when the loop is left by an exception or Ctrl+C, so queued samples and the open shard are kept
+        window.close()
+        if saver:
+            saver.close() # flush pending samples
+        if writer:
+            writer.close() # finalize the open shard
+        elapsed = time.monotonic() - started # includes draining the save queue
+        if manifest:
+            manifest.close()
+        if recorder:
+            print(recorder.summary_lines())
+            metrics.disable()
+        capture = cap.stats()
+        cap.release()
+        display.close()
+
+    summary = {'accepted': instance_num, 'rejected': rejected, 'latency': latencies.summary(), 'elapsed': elapsed, 'capture': capture}
+    print(summary['latency'])
+    if saver:
+        print(f"Saved {saver.saved} samples, {len(saver.errors)} failed")
+    print(summary['capture'])
+    return summary
         
+def multi_main(applicant_name, sources, screen_width=1920, screen_height=1080, base='./data', scheduler='grid', require_all=True,
+               display=None, notifier='auto', **scheduler_kwargs):
+    """Calibration sequence over several cameras (indices or video files) with one worker process per camera.
+       Every accepted sample is saved under base/cam<index> with the same filename and gazepoint on each camera."""
+    if isinstance(scheduler, str):
+        scheduler = make_scheduler(scheduler, screen_width, screen_height, **scheduler_kwargs)
+    display = display or Display()
+    notifier = make_notifier(notifier) if isinstance(notifier, str) else notifier
+
+    from lib.multicam import CameraPool
+    with CameraPool(sources, base=base, require_all=require_all) as pool:
+        window = display.stimulus("Calibration", screen_width, screen_height)
+        instance_num = 0
+        while (point := scheduler.next()) is not None:
+            window.show_dot(point)
+            key, _ = window.wait_key()
+            if key != 13:
+                break
+            accepted, results = pool.trigger(point)
+            if accepted:
+                instance_num += 1
+                current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
+                filename = '_'.join([current_time, applicant_name, str(instance_num)])
+                pool.commit(filename)
+                notifier.notify()
+                print(filename, [f"cam{result['camera']} {result['offset'] * 1000:+.1f}ms" for result in results if result['offset'] is not None])
+            else:
+                pool.discard()
+                print([(result['camera'], result['reason']) for result in results])
+            scheduler.report(point, accepted)
+    display.close()
+
+
 if __name__ == "__main__":
     applicant_name = input("Type in the applicant's initial: ")
-    main(applicant_name)
\ No newline at end of file
+    mode = input("Mode ('calibration', 'stream' or 'pipeline', default 'calibration'): ").strip() or 'calibration'
+    if mode in ('stream', 'pipeline'):
+        main(applicant_name, mode=mode, duration=float(input("Capture duration in seconds: ")))
+    else:
+        main(applicant_name)
\ No newline at end of file
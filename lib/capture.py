@@ -0,0 +1,199 @@
+"""
+Threaded frame grabber around cv2.VideoCapture.
+A background thread keeps reading from the device and retains only the newest frame together
+with its capture timestamp, so that a consumer (e.g. a keypress in the calibration loop) gets
+the current frame immediately instead of a stale one sitting in the driver buffer.
+VideoReplay offers the same read interface over a recorded video for headless replays.
+"""
+import cv2
+import threading
+import time
+from collections import deque
+
+
+class FrameGrabber():
+    """Continuously grab frames from a video source on a background thread.
+       Only the most recent frame is kept. Frames that are overwritten before being read are counted as dropped,
+       reads that return an already consumed frame are counted as duplicates.
+    """
+    def __init__(self, source=0, history=8):
+        self.source = source
+        self._cap = cv2.VideoCapture(source)
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._thread = None
+        self._running = False
+
+        self._frame = None # newest frame
+        self._timestamp = None # time.monotonic() right after the frame was grabbed
+        self._seq = 0 # sequence number of the newest frame
+        self._last_read_seq = 0 # sequence number of the last frame handed out
+        self._history = deque(maxlen=history) # (seq, frame, timestamp) of the most recent frames, for burst reads
+
+        self.captured = 0 # number of frames grabbed from the device
+        self.dropped = 0 # frames overwritten before anyone read them
+        self.duplicates = 0 # reads that returned an already consumed frame
+
+    def start(self):
+        if self._running:
+            return self
+        if not self._cap.isOpened():
+            raise RuntimeError(f"Unable to open video source {self.source}")
+        self._running = True
+        self._thread = threading.Thread(target=self._update, daemon=True)
+        self._thread.start()
+        return self
+
+    def _update(self):
+        while self._running:
+            ret, frame = self._cap.read() # blocks for one frame interval
+            timestamp = time.monotonic()
+            if not ret:
+                with self._lock:
+                    self._running = False
+                    self._new_frame.notify_all()
+                break
+            with self._lock:
+                if self._seq > self._last_read_seq: # previous frame was never consumed
+                    self.dropped += 1
+                self._frame = frame
+                self._timestamp = timestamp
+                self._seq += 1
+                self._history.append((self._seq, frame, timestamp))
+                self.captured += 1
+                self._new_frame.notify_all()
+
+    def read(self, copy=True, wait_new=False, timeout=1.0):
+        """Return (frame, timestamp) of the newest frame without waiting for the device.
+           If wait_new is set, block until a frame newer than the last read one arrives (or timeout expires).
+           Returns (None, None) if no frame has been captured yet, if the wait_new wait timed out, or if capturing
+           stopped (device unplugged, read failure) and the last frame was already handed out, so a stale frame
+           is never returned as a new one.
+        """
+        with self._lock:
+            if (self._frame is None or wait_new) and self._running:
+                self._new_frame.wait_for(lambda: self._seq > self._last_read_seq or not self._running, timeout=timeout)
+            unread = self._seq > self._last_read_seq
+            if self._frame is None or (not unread and (wait_new or not self._running)):
+                return None, None
+            if self._seq == self._last_read_seq:
+                self.duplicates += 1
+            self._last_read_seq = self._seq
+            frame, timestamp = self._frame, self._timestamp
+        return (frame.copy() if copy else frame), timestamp
+
+    def read_burst(self, before=2, after=2, timeout=1.0):
+        """Return ([(frame, timestamp), ...], keypress) around now: the newest frame, up to `before` frames preceding it
+           and up to `after` frames captured after the call. keypress is the position of the frame that was newest at
+           the call (None if nothing was captured yet). Frames are not copied and must not be modified.
+        """
+        with self._lock:
+            if not self._running and self._seq == self._last_read_seq: # stopped, nothing new to hand out
+                return [], None
+            newest = self._seq
+            target = newest + after
+            if self._running:
+                self._new_frame.wait_for(lambda: self._seq >= target or not self._running, timeout=timeout)
+            window = [(seq, frame, timestamp) for seq, frame, timestamp in self._history if newest - before <= seq <= target]
+            self._last_read_seq = self._seq
+        keypress = next((i for i, (seq, _, _) in enumerate(window) if seq == newest), None)
+        return [(frame, timestamp) for _, frame, timestamp in window], keypress
+
+    @property
+    def running(self):
+        return self._running
+
+    def stats(self):
+        with self._lock:
+            return {'captured': self.captured, 'dropped': self.dropped, 'duplicates': self.duplicates}
+
+    def release(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        self._cap.release()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class VideoReplay():
+    """Play back a recorded video through the FrameGrabber interface, without a capture thread.
+       Every read advances to the next frame of the file, so a replay with the same key script always sees the
+       same frames. If fps is given, reads are paced to the recording's frame interval like a live camera.
+       Reads return (None, None) once the video is exhausted (unless loop is set).
+    """
+    def __init__(self, path, fps=None, loop=False, history=8):
+        self.source = path
+        self._cap = cv2.VideoCapture(path)
+        self.fps = fps
+        self.loop = loop
+        self._history = deque(maxlen=history)
+        self._seq = 0
+        self._last_time = None
+        self._running = False
+
+        self.captured = 0
+        self.dropped = 0 # always 0, kept for FrameGrabber.stats() compatibility
+        self.duplicates = 0
+
+    def start(self):
+        if not self._cap.isOpened():
+            raise RuntimeError(f"Unable to open video source {self.source}")
+        self._running = True
+        return self
+
+    def _next(self):
+        if self.fps and self._last_time is not None: # pace reads like a live camera
+            delay = self._last_time + 1 / self.fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        ret, frame = self._cap.read()
+        if not ret and self.loop:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._cap.read()
+        if not ret:
+            self._running = False
+            return None, None
+        self._last_time = timestamp = time.monotonic()
+        self._seq += 1
+        self._history.append((self._seq, frame, timestamp))
+        self.captured += 1
+        return frame, timestamp
+
+    def read(self, copy=True, wait_new=False, timeout=1.0):
+        """Return (frame, timestamp) of the next frame of the video"""
+        frame, timestamp = self._next()
+        return (frame.copy() if copy and frame is not None else frame), timestamp
+
+    def read_burst(self, before=2, after=2, timeout=1.0):
+        """Return (burst, keypress) like FrameGrabber.read_burst: the next frame, up to `before` already read frames
+           preceding it and `after` frames following it"""
+        newest = self._seq + 1
+        for _ in range(after + 1):
+            if self._next()[0] is None:
+                break
+        window = [(seq, frame, timestamp) for seq, frame, timestamp in self._history if newest - before <= seq]
+        keypress = next((i for i, (seq, _, _) in enumerate(window) if seq == newest), None)
+        return [(frame, timestamp) for _, frame, timestamp in window], keypress
+
+    @property
+    def running(self):
+        return self._running
+
+    def stats(self):
+        return {'captured': self.captured, 'dropped': self.dropped, 'duplicates': self.duplicates}
+
+    def release(self):
+        self._running = False
+        self._cap.release()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.release()
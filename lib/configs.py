@@ -5,4 +5,8 @@ LANDMARK_INDICES_OF_INTEREST = [36, 37, 38, 39, 40, 41, # LEFT_EYE_POINTS
                                 22, 23, 24, 25, 26 ] # RIGHT_EYEBROW_POINTS  
 
 # Minimum Cumulated Eye Aspect Ratio for determining eye closure
-MINIMUM_EAR = 0.15
\ No newline at end of file
+MINIMUM_EAR = 0.15
+
+# Size (width, height) of the normalized eye patches and the margin left beside each eye corner, relative to the patch width
+EYE_PATCH_SIZE = (60, 36)
+EYE_PATCH_MARGIN = 0.15
@@ -0,0 +1,105 @@
+"""
+Prefetching dataset reader for training.
+Samples are read back in shuffled batches by a pool of background threads, a few batches ahead of the consumer.
+The binary landmark image is rasterized on the fly from the stored landmark coordinates instead of being loaded
+from face_binary. Both the per-sample directory layout written by Face.save and the sharded layout of lib.shards
+are supported.
+"""
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from lib.preprocessing import generate_landmark_image
+from lib.shards import META_FILENAME, ShardReader
+from lib.visualization import load_npy
+
+
+class DatasetReader():
+    """Iterate over a dataset in (optionally shuffled) batches of stacked NumPy arrays.
+       Every batch is a dict with 'name', 'face' (B, H, W, C) uint8, 'face_binary' (B, H, W) uint8,
+       'landmarks' (B, N, 2) int and 'gazepoint' (B, 2) int. With get_eye, 'eye_left'/'eye_right' are (B, h, w, C) uint8
+       stacks of the fixed-size eye patches (datasets with ragged eye crops must be regenerated with reprocess.py first).
+    """
+    def __init__(self, base='./data', batch_size=32, shuffle=True, seed=None, prefetch=4, num_workers=4,
+                 get_eye=False, face_format='jpg', drop_last=False):
+        self.base = base
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.prefetch = prefetch # number of batches loaded ahead of the consumer
+        self.num_workers = num_workers
+        self.get_eye = get_eye
+        self.face_format = face_format # 'jpg' or 'npy' for the per-sample layout
+        self.drop_last = drop_last
+        self._rng = np.random.default_rng(seed)
+
+        if os.path.exists(os.path.join(base, META_FILENAME)):
+            self._shards = ShardReader(base)
+            self.names = list(range(len(self._shards)))
+        else: # a single directory listing, sample names are the landmark json stems
+            self._shards = None
+            self.names = sorted(filename[:-len('.json')] for filename in os.listdir(os.path.join(base, 'landmark_coordinates'))
+                                if filename.endswith('.json'))
+
+    def __len__(self):
+        full, rest = divmod(len(self.names), self.batch_size)
+        return full + (1 if rest and not self.drop_last else 0)
+
+    def _load_file_sample(self, name):
+        if self.face_format == 'jpg':
+            face = cv2.imread(os.path.join(self.base, 'face_image', f'{name}.jpg'))
+        else:
+            face = load_npy(os.path.join(self.base, 'face_image', f'{name}.npy'))
+        with open(os.path.join(self.base, 'landmark_coordinates', f'{name}.json')) as file:
+            landmarks = json.load(file)
+        with open(os.path.join(self.base, 'gazepoint', f'{name}.json')) as file:
+            gazepoint = json.load(file)
+        sample = {'name': name, 'face': face, 'landmarks': np.asarray(landmarks, dtype=int), 'gazepoint': gazepoint}
+        if self.get_eye:
+            sample['eye_left'] = cv2.imread(os.path.join(self.base, 'eye_image_left', f'{name}.jpg'))
+            sample['eye_right'] = cv2.imread(os.path.join(self.base, 'eye_image_right', f'{name}.jpg'))
+        return sample
+
+    def _load_shard_sample(self, idx):
+        record = self._shards[idx]
+        sample = {'name': record['name'], 'face': np.array(record['face']), 'landmarks': np.array(record['landmarks'], dtype=int),
+                  'gazepoint': record['gazepoint'].tolist()}
+        if self.get_eye:
+            sample['eye_left'], sample['eye_right'] = record['eye_left'], record['eye_right'] # memmap views, copied once by np.stack
+        return sample
+
+    def _load_batch(self, names):
+        load = self._load_file_sample if self._shards is None else self._load_shard_sample
+        samples = [load(name) for name in names]
+        faces = np.stack([sample['face'] for sample in samples])
+        batch = {
+            'name': [sample['name'] for sample in samples],
+            'face': faces,
+            'face_binary': np.stack([generate_landmark_image(sample['landmarks'], faces.shape[1:3], dtype=np.uint8) for sample in samples]),
+            'landmarks': np.stack([sample['landmarks'] for sample in samples]),
+            'gazepoint': np.array([sample['gazepoint'] for sample in samples], dtype=int),
+        }
+        if self.get_eye: # eye patches are fixed-size, so they stack like the faces
+            batch['eye_left'] = np.stack([sample['eye_left'] for sample in samples])
+            batch['eye_right'] = np.stack([sample['eye_right'] for sample in samples])
+        return batch
+
+    def _batches(self):
+        order = self._rng.permutation(len(self.names)) if self.shuffle else np.arange(len(self.names))
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            if self.drop_last and len(indices) < self.batch_size:
+                return
+            yield [self.names[i] for i in indices]
+
+    def __iter__(self):
+        """One epoch. Batches are loaded by background threads, at most prefetch batches ahead"""
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            pending = deque()
+            for names in self._batches():
+                pending.append(pool.submit(self._load_batch, names))
+                if len(pending) >= self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
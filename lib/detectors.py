@@ -0,0 +1,138 @@
+"""
+Face detector backends for FaceEstimator. A backend is a callable taking a BGR or grayscale uint8 frame and
+returning a list of (left, top, right, bottom) boxes. The landmark predictor stays separate in FaceEstimator.
+1. 'hog'      : dlib HOG frontal face detector on the full frame (reference)
+2. 'hog_half' : dlib HOG on a frame downscaled by 0.5
+3. 'haar'     : OpenCV Haar cascade bundled with opencv-python
+4. 'lbp'      : OpenCV LBP cascade (only if the lbpcascades data is shipped with the OpenCV install)
+calibrate() measures every backend's latency and its agreement with the HOG reference on sample frames
+and picks the fastest one that meets the agreement threshold. Without enough frames on which the reference
+finds a face there is no evidence to judge the backends by, and the reference is kept.
+"""
+import os
+import time
+import cv2
+import numpy as np
+
+
+class DlibHOGDetector():
+    name = 'hog'
+
+    def __init__(self, scale=1.0, upsample=0):
+        import dlib
+        self._detector = dlib.get_frontal_face_detector()
+        self.scale = scale
+        self.upsample = upsample
+
+    def __call__(self, frame):
+        if self.scale != 1.0:
+            frame = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return [tuple(int(round(v / self.scale)) for v in (rect.left(), rect.top(), rect.right(), rect.bottom()))
+                for rect in self._detector(frame, self.upsample)]
+
+
+class DownscaledHOGDetector(DlibHOGDetector):
+    name = 'hog_half'
+
+    def __init__(self, scale=0.5, upsample=0):
+        super().__init__(scale=scale, upsample=upsample)
+
+
+class CascadeDetector():
+    """OpenCV cascade classifier. kind is 'haar' or 'lbp'"""
+    FILES = {'haar': 'haarcascade_frontalface_default.xml', 'lbp': 'lbpcascade_frontalface_improved.xml'}
+
+    def __init__(self, kind='haar', scale_factor=1.1, min_neighbors=5, min_size=(80, 80)):
+        self.name = kind
+        path = self._find(kind)
+        self._cascade = cv2.CascadeClassifier(path)
+        if self._cascade.empty():
+            raise ValueError(f"Unable to load cascade {path}")
+        self.scale_factor, self.min_neighbors, self.min_size = scale_factor, min_neighbors, min_size
+
+    def _find(self, kind):
+        haar_dir = cv2.data.haarcascades
+        candidates = [os.path.join(haar_dir, self.FILES[kind]),
+                      os.path.join(os.path.dirname(os.path.normpath(haar_dir)), 'lbpcascades', self.FILES[kind])]
+        for path in candidates:
+            if os.path.exists(path):
+                return path
+        raise FileNotFoundError(f"{self.FILES[kind]} is not bundled with this OpenCV install")
+
+    def __call__(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        boxes = self._cascade.detectMultiScale(gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors, minSize=self.min_size)
+        return [(int(x), int(y), int(x + w), int(y + h)) for x, y, w, h in boxes]
+
+
+BACKENDS = {
+    'hog': DlibHOGDetector,
+    'hog_half': DownscaledHOGDetector,
+    'haar': lambda: CascadeDetector('haar'),
+    'lbp': lambda: CascadeDetector('lbp'),
+}
+
+
+def make_detector(name):
+    return BACKENDS[name]()
+
+
+def iou(a, b):
+    """Intersection over union of two (left, top, right, bottom) boxes"""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    inter = width * height
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+
+def _agrees(boxes, reference, min_iou):
+    if len(reference) != 1: # frames without exactly one reference face: agree if the backend also rejects them
+        return len(boxes) != 1
+    return len(boxes) == 1 and iou(boxes[0], reference[0]) >= min_iou
+
+
+def calibrate(frames, backends=None, reference='hog', min_agreement=0.9, min_iou=0.4, min_faces=10):
+    """Time each backend on frames and compare it to the reference backend.
+       Returns (name and instance of the fastest backend with agreement >= min_agreement, per-backend report).
+       Backends that cannot be created (missing dlib/cascade files) are reported and skipped. If the reference
+       finds a single face on fewer than min_faces frames, the reference itself is returned. None frames are skipped."""
+    frames = [frame for frame in frames if frame is not None]
+    backends = backends or list(BACKENDS)
+    instances, report = {}, {}
+    for name in dict.fromkeys([reference] + backends):
+        try:
+            instances[name] = make_detector(name)
+        except (ImportError, FileNotFoundError, ValueError) as e:
+            report[name] = {'error': str(e)}
+
+    if reference not in instances:
+        raise RuntimeError(f"Reference detector '{reference}' is unavailable: {report[reference]['error']}")
+    if not frames:
+        report[reference] = {'error': 'no frames to calibrate on'}
+        return reference, instances[reference], report
+
+    detections = {}
+    for name, detector in instances.items():
+        detector(frames[0]) # warmup
+        latencies, boxes = [], []
+        for frame in frames:
+            start = time.perf_counter()
+            boxes.append(detector(frame))
+            latencies.append(time.perf_counter() - start)
+        detections[name] = boxes
+        report[name] = {'latency_ms_p50': float(np.percentile(latencies, 50) * 1000), 'latency_ms_mean': float(np.mean(latencies) * 1000)}
+
+    faces = sum(len(boxes) == 1 for boxes in detections[reference])
+    if faces < min_faces: # e.g. nobody in front of the camera yet: every backend would "agree" on empty frames
+        report[reference]['error'] = f'reference found a face on {faces} of {len(frames)} frames, need {min_faces}'
+        return reference, instances[reference], report
+
+    for name in instances:
+        agreement = np.mean([_agrees(boxes, ref, min_iou) for boxes, ref in zip(detections[name], detections[reference])])
+        report[name]['agreement'] = float(agreement)
+
+    eligible = [name for name in instances if report[name]['agreement'] >= min_agreement]
+    best = min(eligible, key=lambda name: report[name]['latency_ms_p50']) # the reference always qualifies
+    return best, instances[best], report
@@ -1,48 +1,96 @@
+import cv2
 import numpy as np
 import json
 import os
 from datetime import datetime
+from lib.configs import EYE_PATCH_SIZE, EYE_PATCH_MARGIN
+
+def calc_EAR(landmarks):
+    """Eye aspect ratio (|p2-p6| + |p3-p5|) / (2|p1-p4|) over the six (6, 2) eye landmarks"""
+    vertical = np.abs(landmarks[[1, 2], 1] - landmarks[[5, 4], 1]).sum()
+    horizontal = abs(landmarks[0, 0] - landmarks[3, 0])
+    return int(vertical) / (2 * int(horizontal))
+
+
+def eye_patch_transforms(landmarks, size=EYE_PATCH_SIZE, margin=EYE_PATCH_MARGIN):
+    """(N, 2, 3) similarity transforms mapping the eye corners landmarks[:, 0] and landmarks[:, 3] of (N, 6, 2)
+       eye landmarks onto a horizontal line through the middle of a size (width, height) patch, margin*width
+       away from its sides. Rotation, scale and translation of every eye are solved at once."""
+    landmarks = np.asarray(landmarks, dtype=np.float64).reshape(-1, 6, 2)
+    width, height = size
+    p0 = landmarks[:, 0, 0] + 1j * landmarks[:, 0, 1]
+    p1 = landmarks[:, 3, 0] + 1j * landmarks[:, 3, 1]
+    q0, q1 = margin * width + 0.5j * height, (1 - margin) * width + 0.5j * height
+    # z -> c * z + t as a complex multiplication: rotation and uniform scale in c
+    delta = np.where(p1 != p0, p1 - p0, 1) # coincident corners (degenerate landmarks) must not divide by zero
+    c = (q1 - q0) / delta
+    t = q0 - c * p0
+    transforms = np.empty((len(landmarks), 2, 3))
+    transforms[:, 0] = np.stack([c.real, -c.imag, t.real], axis=1)
+    transforms[:, 1] = np.stack([c.imag, c.real, t.imag], axis=1)
+    return transforms
+
+
+def _warp(frame, transform, size):
+    return cv2.warpAffine(frame, transform, size, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def extract_eye_patches(frames, landmarks, size=EYE_PATCH_SIZE, margin=EYE_PATCH_MARGIN):
+    """Batched eye patch extraction over many faces. frames is a sequence of N frames (or a single frame shared
+       by all eyes) and landmarks the (N, 6, 2) eye landmarks on them.
+       Returns (N, height, width, C) uint8 patches and their (N, 2, 3) transforms, one affine warp per eye."""
+    transforms = eye_patch_transforms(landmarks, size, margin)
+    if isinstance(frames, np.ndarray) and frames.ndim in (2, 3): # one frame for every eye
+        frames = [frames] * len(transforms)
+    patches = [_warp(frame, transform, size) for frame, transform in zip(frames, transforms)]
+    if not patches:
+        return np.zeros((0, size[1], size[0], 3), dtype=np.uint8), transforms
+    return np.stack(patches), transforms
+
 
 class Eye():
     """
     note: The frame required during initialization is a whole face not a cropped eye image
+    The eye is warped into a fixed size (width, height) patch, rotated so the eye corners lie on a horizontal line.
+    With size=None the padded axis-aligned crop is kept instead. Either way only a contiguous uint8 array is kept,
+    so an Eye never pins the whole face frame in memory.
     """
-    def __init__(self, frame, landmarks):
-        self.landmarks = landmarks
+    __slots__ = ('landmarks', 'frame', 'boundingbox', 'EAR', 'transform')
+
+    def __init__(self, frame, landmarks, size=EYE_PATCH_SIZE):
+        self.landmarks = np.asarray(landmarks, dtype=int).reshape(-1, 2) # (6, 2) eye landmarks
         self.frame = frame
-        self._prep()
+        self._prep(size)
        
-    def _prep(self):
+    def _prep(self, size):
         self.boundingbox = self._set_boundingbox()
-        self.frame = self._crop_out_eye(self.boundingbox, padding=5)
+        if size is None:
+            self.transform = None
+            self.frame = self._crop_out_eye(self.boundingbox, padding=5).copy() # own the crop instead of a view into the face frame
+        else:
+            self.transform = eye_patch_transforms(self.landmarks, size)[0] # (2, 3) frame -> patch coordinates
+            self.frame = _warp(self.frame, self.transform, size)
         self.EAR = self._calc_EAR()
+
+    def normalized(self, scale=255.0):
+        """Eye crop as float64 divided by scale. Computed on access, not kept on the object"""
+        return self.frame / scale
         
     def _calc_EAR(self):
-        """"""
-        p1, p4 = self.landmarks[0][0], self.landmarks[3][0]
-        p2, p6 = self.landmarks[1][1], self.landmarks[5][1]
-        p3, p5 = self.landmarks[2][1], self.landmarks[4][1]
-        return ((abs(p2-p6) + abs(p3-p5)) / (2 * abs(p1-p4))) 
+        """Eye aspect ratio (|p2-p6| + |p3-p5|) / (2|p1-p4|) over the six eye landmarks"""
+        return calc_EAR(self.landmarks)
          
     def _set_boundingbox(self):
         """Set boundingbox around the eye for future cropping actions"""
-        min_x, max_x, min_y, max_y = self.frame.shape[1], 0, self.frame.shape[0], 0
-        for lm in self.landmarks:
-            min_x = min(lm[0], min_x)
-            max_x = max(lm[0], max_x)
-            min_y = min(lm[1], min_y)
-            max_y = max(lm[1], max_y)
+        min_x, min_y = np.minimum(self.landmarks.min(axis=0), (self.frame.shape[1], self.frame.shape[0])).tolist()
+        max_x, max_y = np.maximum(self.landmarks.max(axis=0), 0).tolist()
         return min_x, max_x, min_y, max_y
     
     def _crop_out_eye(self, boundingbox, padding=5):
         """Crop frames based on the given landmarks"""
         min_x, max_x, min_y, max_y = boundingbox
-        min_x -= padding
-        max_x += padding
-        min_y -= padding
-        max_y += padding
     
-        # Assert that post-padded coord is within the asserted image sizes
+        # Pad once and assert that post-padded coord is within the asserted image sizes
         min_x = max(min_x - padding, 0)
         max_x = min(max_x + padding, self.frame.shape[1] - 1)
         min_y = max(min_y - padding, 0)
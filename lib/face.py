@@ -133,68 +133,77 @@ import os
 import numpy as np
 import json
 from lib.preprocessing import generate_landmark_image
-from lib.eye import Eye
+from lib.eye import Eye, calc_EAR
+from lib import metrics
 from typing import Tuple
-from lib.configs import LANDMARK_INDICES_OF_INTEREST
+from lib.configs import LANDMARK_INDICES_OF_INTEREST, EYE_PATCH_SIZE
 
 # These are indices of facial landmarks of interest that will be used for modeling
+# Sorted so that selected points keep the order of the 68-point model (eyes at [27:33] and [33:39])
+_LANDMARK_INDEX = np.unique(LANDMARK_INDICES_OF_INTEREST)
 
 class Face():
+    # Fixed attribute layout keeps per-sample objects small while many are in flight (async saving, batch reprocessing)
+    __slots__ = ('_LANDMARK_INDICES_OF_INTEREST', 'frame', 'boundingbox', 'landmarks', 'gazepoint', 'eyes', 'timing')
+
     def __init__(self, frame, boundingbox, landmarks, gazepoint=None):
         self._LANDMARK_INDICES_OF_INTEREST = LANDMARK_INDICES_OF_INTEREST
         self.frame = frame # original frame
         self.boundingbox = boundingbox # bb around face region on original frame. List[Tuple[int, int], Tuple[int, int]]
-        self.landmarks = [point for idx, point in enumerate(landmarks) if idx in self._LANDMARK_INDICES_OF_INTEREST]
+        self.landmarks = np.asarray(landmarks, dtype=int).reshape(-1, 2)[_LANDMARK_INDEX] # (N, 2) int array of (x, y)
         self.gazepoint = gazepoint # 2D Gaze target onscreen location 
         self.eyes = None
-
-    def fit(self, size=(244, 244), padding=10, crop_eye=False):
+        self.timing = None # dot onset/keypress/capture timestamps of the sample, see lib.presentation.LatencyTracker
+
+    @classmethod
+    def restore(cls, frame, boundingbox, landmarks, gazepoint=None, eyes=None, timing=None):
+        """Rebuild an already fitted Face (e.g. received from another process) without re-selecting landmarks"""
+        face = cls.__new__(cls)
+        face._LANDMARK_INDICES_OF_INTEREST = LANDMARK_INDICES_OF_INTEREST
+        face.frame, face.boundingbox, face.landmarks = frame, boundingbox, np.asarray(landmarks, dtype=int)
+        face.gazepoint, face.eyes, face.timing = gazepoint, eyes, timing
+        return face
+
+    @metrics.timed('fit')
+    def fit(self, size=(244, 244), padding=10, crop_eye=False, eye_size=EYE_PATCH_SIZE):
         """Applies preprocessing steps to the current Face object. Preprocessing steps include cropping and resizing.
-           landmark coordinates are aligned according to the undergoing transformation."""
+           landmark coordinates are aligned according to the undergoing transformation.
+           With crop_eye, both eyes are warped from the original frame into eye_size (width, height) patches."""
         try:
             if crop_eye: # Instantiate Eye objects
-                left_eye, right_eye = Eye(self.frame, self.landmarks[27:33]), Eye(self.frame, self.landmarks[33:40])
+                left_eye, right_eye = Eye(self.frame, self.landmarks[27:33], eye_size), Eye(self.frame, self.landmarks[33:40], eye_size)
                 self.eyes = [left_eye, right_eye]
 
             # Perform Cropping 
             cropped = self._crop(padding=padding) 
             
-            newlandmarks = self._align(dx=self.boundingbox[0][0]-padding, 
-                                       dy=self.boundingbox[0][1]-padding) # align
+            newlandmarks = self._translate(dx=self.boundingbox[0][0]-padding, 
+                                           dy=self.boundingbox[0][1]-padding) # align
             
             self._refresh(cropped, newlandmarks) # apply changes
             
-            # Perform Resizing
+            # Perform Resizing. cv2.resize returns a new contiguous uint8 array, so the original frame is released here
             cropped_and_resized = self._resize(size=size)
             x, y, _ = self.frame.shape 
             
             dx, dy = size[0] / x, size[1] / y
-            newlandmarks = self._align(dx, dy)
+            newlandmarks = self._scale(dx, dy, limit=(size[0]-1, size[1]-1))
             self._refresh(cropped_and_resized, newlandmarks)
             return True
         except:
             raise ValueError("Error during fit process")
 
         
-    def _align(self, dx, dy):
-        """Realign landmark points depending on the transformation. 
-           If dx & dy are integers specifying the top left coord of the boundingbox, points are aligned relative to the new top-left corner. 
-           If dx & dy are floats specifying the resizing ratios, points are algined accordingly. 
-        """
-        aligned_landmarks = [] # List for containing newly aligned coords
-        
-        if type(dx) == int and type(dy) == int: # Realign in conjunction to cropping
-            for idx in range(len(self.landmarks)):
-                point = self.landmarks[idx] 
-                aligned_landmarks.append((point[0]-dx, point[1]-dy))
+    def _translate(self, dx, dy):
+        """Realign landmark points relative to a new top-left corner (dx, dy), in conjunction to cropping"""
+        return self.landmarks - np.array((dx, dy))
 
-        elif type(dx) == float and type(dy) == float: # Realign in conjunction to resizing 
-            for idx in range(len(self.landmarks)):
-                coord_x, coord_y = self.landmarks[idx]
-                n_coord_x = self._ceil(int(coord_x * dx), 244-1) 
-                n_coord_y = self._ceil(int(coord_y * dy), 244-1)
-                aligned_landmarks.append((n_coord_x, n_coord_y))
-        return aligned_landmarks
+
+    def _scale(self, dx, dy, limit=(244-1, 244-1)):
+        """Realign landmark points by the resizing ratios (dx, dy), in conjunction to resizing. 
+           Scaled coords are truncated to int and capped at limit.
+        """
+        return np.minimum((self.landmarks * np.array((dx, dy))).astype(int), np.array(limit))
 
 
     def _crop(self, padding):
@@ -214,28 +223,49 @@ class Face():
 
     def _resize(self, size):
         return cv2.resize(self.frame, size)
-    
 
-    def _ceil(self, n, threshold):
-        if n > threshold:
-            n = threshold
-        return n
-
-    def save(self, filename, base='./data/', normalize=True, get_eye=True):
+    def eye_aspect_ratio(self):
+        """Average EAR of both eyes straight from the landmarks, without cropping. 0 for degenerate eye landmarks.
+           Cropping does not change the EAR, so this equals the average of Eye.EAR after fit(crop_eye=True)."""
+        try:
+            return (calc_EAR(self.landmarks[27:33]) + calc_EAR(self.landmarks[33:39])) / 2
+        except ZeroDivisionError:
+            return 0.0
+
+    def normalized(self, scale=255.0):
+        """Face frame as float64 divided by scale. Computed on access, not kept on the object"""
+        return self.frame / scale
+
+    @metrics.timed('save', sample=lambda self, filename, *args, **kwargs: filename)
+    def save(self, filename, base='./data/', normalize=True, get_eye=True, writer=None, manifest=None):
+        """Save face/eye images, binary landmark image, landmark coordinates and gazepoint under base.
+           If a ShardWriter is given as writer, the sample is appended to its shards as uint8 instead.
+           If a Manifest is given, the sample is recorded as pending before and as complete after writing
+           (for shards: once its shard has been finalized and the sample can be read back)."""
+        if manifest is not None:
+            manifest.begin(self, filename)
+        if writer is not None:
+            on_finalized = None
+            if manifest is not None:
+                # face_binary is not stored in shards but rebuilt from the landmark coordinates, so the sample has it
+                modalities = ['face_image', 'face_binary', 'landmark_coordinates', 'gazepoint'] + (['eye_image_left', 'eye_image_right'] if self.eyes else [])
+                on_finalized = lambda location: manifest.complete(filename, modalities, location)
+            writer.append(self, filename, on_finalized=on_finalized)
+            return
         if normalize: 
             r = 255.0 
         else: 
             r = 1.0  
         jpgfilename = '.'.join([filename, 'jpg'])
         # Save face frames in both formats (jpg and npy)
-        np.save(os.path.join(base, 'face_image', filename), self.frame / r)
+        np.save(os.path.join(base, 'face_image', filename), self.normalized(r))
         np.save(os.path.join(base, 'face_binary', filename), binary_img := generate_landmark_image(self.landmarks, (self.frame.shape[0], self.frame.shape[1])))
         cv2.imwrite(os.path.join(base, 'face_image', jpgfilename), self.frame)
         cv2.imwrite(os.path.join(base, 'face_binary', jpgfilename), binary_img)
 
         if get_eye:
-            np.save(os.path.join(base, 'eye_image_left', filename), self.eyes[0].frame / r)
-            np.save(os.path.join(base, 'eye_image_right', filename), self.eyes[1].frame / r)
+            np.save(os.path.join(base, 'eye_image_left', filename), self.eyes[0].normalized(r))
+            np.save(os.path.join(base, 'eye_image_right', filename), self.eyes[1].normalized(r))
 
             cv2.imwrite(os.path.join(base, 'eye_image_left', jpgfilename), self.eyes[0].frame)
             cv2.imwrite(os.path.join(base, 'eye_image_right', jpgfilename), self.eyes[1].frame)
@@ -243,7 +273,16 @@ class Face():
         # Write metainfo to the respective directories
         jsonfilename = '.'.join([filename, 'json'])
         with open(os.path.join(base, 'landmark_coordinates', jsonfilename), 'w') as file: # 2d landmark coordinates
-            json.dump(self.landmarks, file) 
+            json.dump(self.landmarks.tolist(), file) 
             
         with open(os.path.join(base, 'gazepoint', jsonfilename), 'w') as file:
-            json.dump(self.gazepoint, file) 
\ No newline at end of file
+            json.dump(self.gazepoint, file) 
+
+        if self.timing is not None: # stimulus/capture latency of the sample
+            os.makedirs(os.path.join(base, 'latency'), exist_ok=True) # data dirs prepared before latency was recorded lack it
+            with open(os.path.join(base, 'latency', jsonfilename), 'w') as file:
+                json.dump(self.timing, file)
+
+        if manifest is not None:
+            modalities = ['face_image', 'face_binary', 'landmark_coordinates', 'gazepoint'] + (['eye_image_left', 'eye_image_right'] if get_eye else [])
+            manifest.complete(filename, modalities)
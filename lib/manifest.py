@@ -0,0 +1,129 @@
+"""
+SQLite-backed sample manifest.
+Face.save records every sample in a 'samples' table: applicant, session, gazepoint, EAR, face boundingbox,
+the modalities that were written, shard offsets (for the sharded format) and a status. A row is inserted as
+'pending' before any file is written and switched to 'complete' afterwards, each step in its own transaction,
+so samples interrupted by a crash can be found and redone. Queries go through indexes instead of directory listings.
+"""
+import sqlite3
+import threading
+import time
+
+MODALITIES = ('face_image', 'face_binary', 'eye_image_left', 'eye_image_right', 'landmark_coordinates', 'gazepoint')
+ALL_MODALITIES = (1 << len(MODALITIES)) - 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    applicant TEXT,
+    session TEXT,
+    gaze_x INTEGER,
+    gaze_y INTEGER,
+    ear REAL,
+    bbox_left INTEGER,
+    bbox_top INTEGER,
+    bbox_right INTEGER,
+    bbox_bottom INTEGER,
+    modalities INTEGER NOT NULL DEFAULT 0,
+    shard TEXT,
+    shard_index INTEGER,
+    face_offset INTEGER,
+    eye_left_offset INTEGER,
+    eye_right_offset INTEGER,
+    status TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_applicant ON samples (applicant);
+CREATE INDEX IF NOT EXISTS samples_session_status ON samples (session, status);
+CREATE INDEX IF NOT EXISTS samples_session_gaze ON samples (session, gaze_x, gaze_y);
+CREATE INDEX IF NOT EXISTS samples_status ON samples (status);
+"""
+
+
+def modality_mask(names):
+    """Bitmask of the given modality names"""
+    mask = 0
+    for name in names:
+        mask |= 1 << MODALITIES.index(name)
+    return mask
+
+
+class Manifest():
+    """Sample manifest of one database file. applicant and session are the defaults for recorded samples"""
+    def __init__(self, path='./data/manifest.sqlite', applicant=None, session=None):
+        self.path = path
+        self.applicant = applicant
+        self.session = session
+        self._lock = threading.Lock() # one connection shared by the AsyncSaver workers
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(SCHEMA)
+
+    def begin(self, face, filename):
+        """Insert (or reset) the row of a sample as 'pending' before its files are written"""
+        (left, top), (right, bottom) = face.boundingbox
+        gaze_x, gaze_y = face.gazepoint if face.gazepoint is not None else (None, None)
+        ear = (face.eyes[0].EAR + face.eyes[1].EAR) / 2 if face.eyes else face.eye_aspect_ratio()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO samples (filename, applicant, session, gaze_x, gaze_y, ear, bbox_left, bbox_top, bbox_right, bbox_bottom, status, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (filename, self.applicant, self.session, gaze_x, gaze_y, float(ear), int(left), int(top), int(right), int(bottom), 'pending', time.time()))
+
+    def complete(self, filename, modalities, location=None):
+        """Mark a sample 'complete' with the modalities written and, for shards, its location from ShardWriter.append"""
+        location = location or {}
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE samples SET status = ?, modalities = ?, shard = ?, shard_index = ?, face_offset = ?, eye_left_offset = ?, eye_right_offset = ? '
+                'WHERE filename = ?',
+                ('complete', modality_mask(modalities), location.get('shard'), location.get('index'), location.get('face_offset'),
+                 location.get('eye_left_offset'), location.get('eye_right_offset'), filename))
+
+    def mark(self, filename, status):
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE samples SET status = ? WHERE filename = ?', (status, filename))
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def samples(self, applicant=None, session=None, status=None):
+        """Rows matching all given filters"""
+        clauses, params = [], []
+        for column, value in (('applicant', applicant), ('session', session), ('status', status)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        return self._query(f'SELECT * FROM samples{where} ORDER BY id', params)
+
+    def count_by_applicant(self, status='complete'):
+        rows = self._query('SELECT applicant, COUNT(*) AS n FROM samples WHERE status = ? GROUP BY applicant', (status,))
+        return {row['applicant']: row['n'] for row in rows}
+
+    def missing_modalities(self, expected=MODALITIES, session=None):
+        """Complete samples lacking any of the expected modalities, with the names of the missing ones"""
+        mask = modality_mask(expected)
+        sql = 'SELECT * FROM samples WHERE status = ? AND (modalities & ?) != ?'
+        params = ['complete', mask, mask]
+        if session is not None:
+            sql += ' AND session = ?'
+            params.append(session)
+        rows = self._query(sql, params)
+        for row in rows:
+            row['missing'] = [name for name in expected if not row['modalities'] & modality_mask([name])]
+        return rows
+
+    def completed_points(self, session=None):
+        """Gazepoints with a complete sample in session (default: this manifest's session)"""
+        rows = self._query('SELECT gaze_x, gaze_y FROM samples WHERE session = ? AND status = ?',
+                           (session if session is not None else self.session, 'complete'))
+        return [(row['gaze_x'], row['gaze_y']) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
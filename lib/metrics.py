@@ -0,0 +1,166 @@
+"""
+Opt-in hot-path instrumentation for acquisition sessions.
+Nothing is recorded unless a session recorder is enabled with enable(). While disabled, stage() returns a shared
+no-op context and timed() calls straight through, so the instrumented functions cost one global lookup.
+
+Each keypress becomes one sample record holding the offset/duration of every stage timed while it was open,
+its outcome (accepted/rejected), the reject reason and how often its gazepoint was requeued before. Stages that
+run on other threads (e.g. Face.save on AsyncSaver workers) are written as separate 'stage' events keyed by sample name.
+Stages timed outside of any sample (e.g. preview frames) only feed the running averages of the overlay.
+Records are appended to a .jsonl or .csv log.
+"""
+import csv
+import functools
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+STAGES = ('capture', 'inspect', 'fit', 'ear_gate', 'save')
+CSV_FIELDS = ['event', 'sample', 'time', 'gaze_x', 'gaze_y', 'outcome', 'reason', 'requeues'] + \
+             [f'{stage}_{field}' for stage in STAGES for field in ('start_ms', 'ms')]
+
+_recorder = None # active SessionMetrics, None while instrumentation is off
+
+
+class _NullStage():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage():
+    __slots__ = ('_recorder', '_name', '_sample', '_start')
+
+    def __init__(self, recorder, name, sample):
+        self._recorder, self._name, self._sample = recorder, name, sample
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._recorder._add_stage(self._name, self._start, time.perf_counter(), self._sample)
+        return False
+
+
+class SessionMetrics():
+    """Collect per-sample stage timings and outcomes and append them to a JSONL/CSV log"""
+    def __init__(self, path, window=50):
+        self.path = path
+        self._csv = path.endswith('.csv')
+        self._file = open(path, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=CSV_FIELDS, extrasaction='ignore') if self._csv else None
+        if self._csv and self._file.tell() == 0:
+            self._writer.writeheader()
+        self._lock = threading.Lock()
+        self._current = None
+        self._owner = None # thread that opened the current sample
+
+        self.counts = defaultdict(int) # outcome/reason -> count
+        self._recent = defaultdict(lambda: deque(maxlen=window)) # stage -> recent durations in ms
+
+    def begin_sample(self, gazepoint=None, requeues=0):
+        self._owner = threading.get_ident()
+        self._current = {'event': 'sample', 'time': time.time(), 'start': time.perf_counter(),
+                         'gaze_x': gazepoint[0] if gazepoint else None, 'gaze_y': gazepoint[1] if gazepoint else None,
+                         'requeues': requeues, 'stages': {}}
+
+    def stage(self, name, sample=None):
+        return _Stage(self, name, sample)
+
+    def _add_stage(self, name, start, stop, sample):
+        duration = (stop - start) * 1000
+        with self._lock:
+            self._recent[name].append(duration)
+            current = self._current
+            if sample is None and current is not None and threading.get_ident() == self._owner:
+                current['stages'][name] = ((start - current['start']) * 1000, duration)
+            elif sample is not None: # named stages (e.g. saves on worker threads) become separate events
+                self._write({'event': 'stage', 'sample': sample, 'time': time.time(), 'stages': {name: (None, duration)}})
+
+    def end_sample(self, outcome, reason=None, sample=None):
+        """Close the current sample with outcome 'accepted'/'rejected'/'aborted' and an optional reject reason"""
+        current, self._current = self._current, None
+        if current is None:
+            return
+        current.update(outcome=outcome, reason=reason, sample=sample)
+        del current['start']
+        with self._lock:
+            self.counts[outcome] += 1
+            if reason:
+                self.counts[reason] += 1
+            self._write(current)
+
+    def _write(self, record):
+        if self._csv:
+            row = {key: value for key, value in record.items() if key != 'stages'}
+            for name, (start, duration) in record['stages'].items():
+                row[f'{name}_start_ms'], row[f'{name}_ms'] = start, duration
+            self._writer.writerow(row)
+        else:
+            self._file.write(json.dumps(record) + '\n')
+
+    def summary_lines(self):
+        """Short text summary for the live overlay"""
+        with self._lock:
+            accepted, rejected = self.counts['accepted'], self.counts['rejected']
+            reasons = ', '.join(f'{reason} {count}' for reason, count in self.counts.items() if reason not in ('accepted', 'rejected', 'aborted'))
+            stages = '  '.join(f'{name} {sum(values) / len(values):.1f}ms' for name, values in self._recent.items() if values)
+        return [f'accepted {accepted}  rejected {rejected}' + (f' ({reasons})' if reasons else ''), stages]
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def enable(path):
+    """Start recording to path (.jsonl or .csv). Returns the recorder"""
+    global _recorder
+    _recorder = SessionMetrics(path)
+    return _recorder
+
+
+def disable():
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.close()
+
+
+def active():
+    return _recorder
+
+
+def stage(name, sample=None):
+    """Context manager timing a stage of the current sample (no-op while disabled)"""
+    if _recorder is None:
+        return _NULL_STAGE
+    return _recorder.stage(name, sample)
+
+
+def begin_sample(gazepoint=None, requeues=0):
+    if _recorder is not None:
+        _recorder.begin_sample(gazepoint, requeues)
+
+
+def end_sample(outcome, reason=None, sample=None):
+    if _recorder is not None:
+        _recorder.end_sample(outcome, reason, sample)
+
+
+def timed(name, sample=None):
+    """Decorator timing every call of a function as stage name. sample(*args, **kwargs) may name the sample"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return fn(*args, **kwargs)
+            with _recorder.stage(name, sample(*args, **kwargs) if sample else None):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
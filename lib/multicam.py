@@ -0,0 +1,172 @@
+"""
+Multi-camera acquisition with one worker process per camera.
+Every worker owns its capture device (or a video file standing in for one) and its own FaceEstimator, so dlib
+work on different cameras runs on different cores instead of being serialized by the GIL.
+A trigger is broadcast to all workers with the onscreen gazepoint and a time.monotonic() stamp (a system-wide clock,
+so frame timestamps of different processes are directly comparable). Each worker detects and fits its newest frame
+and reports back; the sample is then committed (saved under base/cam<index>) or discarded on every camera at once.
+A worker that fails (camera won't open, model load or save fails) reports ('error', (index, cause)) and exits;
+start() and trigger() raise with that cause instead of waiting for a reply that never comes.
+"""
+import multiprocessing as mp
+import os
+import queue
+import time
+from lib.configs import MINIMUM_EAR
+
+
+def _camera_worker(index, source, base, commands, results, fit_kwargs):
+    grabber = cap = None
+    try:
+        import cv2
+        import prep_directory
+        from face_estimator import FaceEstimator
+        from lib.capture import FrameGrabber
+
+        out_dir = os.path.join(base, f'cam{index}')
+        prep_directory.make_dirs(out_dir)
+        if isinstance(source, str): # video file stand-in: every trigger consumes the next frame
+            cap, grabber = cv2.VideoCapture(source), None
+            if not cap.isOpened(): # otherwise every trigger would silently come back as 'no_frame'
+                raise RuntimeError(f"Unable to open video source {source}")
+        else:
+            cap, grabber = None, FrameGrabber(source).start()
+        estimator = FaceEstimator() # models are loaded once per process
+        results.put(('ready', index))
+
+        pending = None # (trigger id, fitted face) waiting for commit/discard
+        while True:
+            command = commands.get()
+            if command is None:
+                break
+            kind, trigger_id, payload = command
+            if kind == 'trigger':
+                gazepoint, trigger_time = payload
+                if grabber is not None:
+                    frame, frame_time = grabber.read()
+                else:
+                    ret, frame = cap.read()
+                    frame, frame_time = (frame if ret else None), time.monotonic()
+                result = {'camera': index, 'trigger': trigger_id, 'frame_time': frame_time,
+                          'offset': (frame_time - trigger_time) if frame_time is not None else None, 'reason': None}
+                face = estimator.inspect(frame) if frame is not None else None
+                if face is None:
+                    result['reason'] = 'no_frame' if frame is None else ('no_face' if not estimator.last_count else 'multiple_faces')
+                elif face.eye_aspect_ratio() < MINIMUM_EAR:
+                    result['reason'] = 'eyes_closed'
+                else:
+                    face.gazepoint = gazepoint
+                    face.timing = {'onset': None, 'keypress': trigger_time, 'capture': frame_time} # saved with the sample
+                    try:
+                        face.fit(crop_eye=True, **fit_kwargs)
+                        pending = (trigger_id, face)
+                    except ValueError:
+                        result['reason'] = 'fit_error'
+                results.put(('result', result))
+            elif kind == 'commit':
+                if pending is not None and pending[0] == trigger_id:
+                    pending[1].save(payload, base=out_dir)
+                pending = None
+            elif kind == 'discard':
+                pending = None
+    except Exception as e:
+        results.put(('error', (index, repr(e))))
+    finally:
+        if grabber is not None:
+            grabber.release()
+        if cap is not None:
+            cap.release()
+
+
+class CameraPool():
+    """Process-per-camera acquisition. sources are camera indices or video file paths.
+       With require_all, a trigger is only accepted when every camera produced a usable face.
+    """
+    def __init__(self, sources, base='./data', require_all=True, timeout=5.0, **fit_kwargs):
+        self.sources = list(sources)
+        self.base = base
+        self.require_all = require_all
+        self.timeout = timeout
+        self._context = mp.get_context('spawn') # fresh interpreters, no forked camera handles or dlib state
+        self._commands = [self._context.Queue() for _ in self.sources]
+        self._results = self._context.Queue()
+        self._workers = [self._context.Process(target=_camera_worker, args=(i, source, base, self._commands[i], self._results, fit_kwargs), daemon=True)
+                         for i, source in enumerate(self.sources)]
+        self._trigger_id = 0
+        self._closed = False
+
+    def start(self, timeout=120.0):
+        """Start the workers and wait until every camera is open and its models are loaded"""
+        for worker in self._workers:
+            worker.start()
+        ready = 0
+        deadline = time.monotonic() + timeout
+        while ready < len(self._workers):
+            try:
+                kind, payload = self._results.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                raise RuntimeError(f"{len(self._workers) - ready} camera worker(s) not ready after {timeout} s") from None
+            if kind == 'error':
+                self._raise_worker_error(payload)
+            ready += kind == 'ready'
+        return self
+
+    def _raise_worker_error(self, payload):
+        index, cause = payload
+        self.close()
+        raise RuntimeError(f"Camera {index} ({self.sources[index]}) failed: {cause}")
+
+    def trigger(self, gazepoint):
+        """Capture on every camera for gazepoint. Returns (accepted, per-camera results sorted by camera)"""
+        self._trigger_id += 1
+        trigger_time = time.monotonic()
+        for commands in self._commands:
+            commands.put(('trigger', self._trigger_id, (gazepoint, trigger_time)))
+
+        results = []
+        deadline = time.monotonic() + self.timeout
+        while len(results) < len(self._commands):
+            try:
+                kind, result = self._results.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                break
+            if kind == 'error': # a worker died, e.g. saving the previous commit failed
+                self._raise_worker_error(result)
+            if kind == 'result' and result['trigger'] == self._trigger_id: # late results of older triggers are dropped
+                results.append(result)
+        results.sort(key=lambda result: result['camera'])
+        usable = [result for result in results if result['reason'] is None]
+        accepted = len(usable) == len(self._commands) if self.require_all else bool(usable)
+        return accepted, results
+
+    def commit(self, filename):
+        """Save the samples of the last trigger on every camera that produced one"""
+        for commands in self._commands:
+            commands.put(('commit', self._trigger_id, filename))
+
+    def discard(self):
+        for commands in self._commands:
+            commands.put(('discard', self._trigger_id, None))
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for commands in self._commands:
+            commands.put(None)
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.join(timeout=10.0)
+        while True: # report failures of the last commits
+            try:
+                kind, payload = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'error':
+                print(f"Camera {payload[0]} failed: {payload[1]}")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
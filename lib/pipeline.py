@@ -0,0 +1,227 @@
+"""
+Pipelined acquisition engine: capture -> detect/fit -> encode/write, one process per stage.
+Frames never get pickled between stages. They are written into a multiprocessing.shared_memory ring of uint8 slots
+and only the slot index plus small metadata travels through the bounded stage queues:
+1. capture stage : grabs frames into a free slot of the frame ring, stamped with time.monotonic(), the current gazepoint
+                   and the time that gazepoint was set
+2. fit stage     : FaceEstimator.inspect + EAR gate + Face.fit on the slot, writes the fitted face into the face ring
+3. encode stage  : rebuilds the fitted Face from the face ring and runs Face.save
+When no frame slot is free the capture stage drops the frame instead of blocking the camera. Every stage keeps
+a shared counter, so throughput per stage can be read from the parent process while the engine runs.
+Unless frame_shape is given, the frame ring is sized from the first frame of the source.
+"""
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from lib.configs import MINIMUM_EAR
+
+COUNTERS = ('captured', 'dropped', 'processed', 'rejected', 'fitted', 'saved', 'failed')
+
+
+class SharedRing():
+    """uint8 slots of a fixed shape in one shared memory block. Create in the parent, attach by name in the stages"""
+    def __init__(self, slots, shape, name=None):
+        self.slots, self.shape = slots, tuple(shape)
+        size = slots * int(np.prod(shape))
+        self._shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self._shm.name
+        self.array = np.ndarray((slots, *self.shape), dtype=np.uint8, buffer=self._shm.buf)
+
+    def attach_args(self):
+        return self.slots, self.shape, self.name
+
+    def close(self):
+        del self.array # release the exported buffer before closing the mapping
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+
+def _free_queue(context, slots):
+    free = context.Queue()
+    for slot in range(slots):
+        free.put(slot)
+    return free
+
+
+def probe_frame_shape(source):
+    """Shape of the first frame delivered by source"""
+    import cv2
+    cap = cv2.VideoCapture(source)
+    try:
+        ret, frame = cap.read()
+    finally:
+        cap.release()
+    if not ret:
+        raise RuntimeError(f"Unable to read a frame from video source {source}")
+    return frame.shape
+
+
+def _capture_stage(source, ring_args, free_slots, out, gazepoint, gazepoint_time, stop, counters):
+    import cv2
+    ring = SharedRing(*ring_args)
+    height, width = ring.shape[:2]
+    cap = cv2.VideoCapture(source)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    seq = 0
+    try:
+        while not stop.is_set():
+            ret, frame = cap.read()
+            timestamp = time.monotonic()
+            if not ret:
+                break
+            counters['captured'].value += 1
+            try:
+                slot = free_slots.get_nowait()
+            except queue.Empty: # downstream is saturated, keep the camera running
+                counters['dropped'].value += 1
+                continue
+            if frame.shape[:2] != (height, width): # only if the source changed resolution after the ring was sized
+                frame = cv2.resize(frame, (width, height))
+            ring.array[slot] = frame
+            with gazepoint.get_lock():
+                label = tuple(gazepoint[:]) if gazepoint[0] >= 0 else None
+                onset = gazepoint_time.value if label is not None else None
+            out.put((slot, seq, timestamp, label, onset))
+            seq += 1
+    finally:
+        out.put(None)
+        cap.release()
+        ring.close()
+
+
+def _fit_stage(frame_args, face_args, free_frames, free_faces, inbox, out, counters, fit_kwargs):
+    frames = faces = None
+    try:
+        from face_estimator import FaceEstimator
+        frames, faces = SharedRing(*frame_args), SharedRing(*face_args)
+        estimator = FaceEstimator() # inside the try: a failed model load must still release the encode stage
+        while (item := inbox.get()) is not None:
+            slot, seq, timestamp, label, onset = item
+            try:
+                face = estimator.inspect(frames.array[slot])
+                if face is None or face.eye_aspect_ratio() < MINIMUM_EAR:
+                    counters['rejected'].value += 1
+                    continue
+                face.gazepoint = label
+                face.timing = {'onset': onset, 'keypress': None, 'capture': timestamp} # onset: when the gazepoint was set
+                face.fit(crop_eye=True, **fit_kwargs)
+                face_slot = free_faces.get()
+                faces.array[face_slot] = face.frame
+                out.put((face_slot, seq, face.boundingbox, face.landmarks, face.gazepoint, face.eyes, face.timing))
+                counters['fitted'].value += 1
+            except ValueError:
+                counters['rejected'].value += 1
+            finally:
+                counters['processed'].value += 1
+                free_frames.put(slot) # frame slot can be reused as soon as fitting is done
+    except Exception as e:
+        print(f"Fit stage stopped: {e!r}")
+        raise
+    finally:
+        out.put(None)
+        for ring in (frames, faces):
+            if ring is not None:
+                ring.close()
+
+
+def _encode_stage(face_args, free_faces, inbox, base, prefix, counters, save_kwargs):
+    from lib.face import Face
+    faces = SharedRing(*face_args)
+    try:
+        while (item := inbox.get()) is not None:
+            face_slot, seq, boundingbox, landmarks, gazepoint, eyes, timing = item
+            face = Face.restore(faces.array[face_slot].copy(), boundingbox, landmarks, gazepoint, eyes, timing)
+            free_faces.put(face_slot)
+            filename = f'{prefix}_{seq:08d}'
+            try:
+                face.save(filename, base=base, **save_kwargs)
+                counters['saved'].value += 1
+            except Exception as e:
+                counters['failed'].value += 1
+                print(f"Failed to save {filename}: {e!r}")
+    finally:
+        faces.close()
+
+
+class Pipeline():
+    """Three-process capture -> detect/fit -> encode engine over shared memory frame rings"""
+    def __init__(self, source=0, prefix='stream', base='./data/', frame_shape=None, face_shape=(244, 244, 3),
+                 frame_slots=16, face_slots=16, save_kwargs=None, **fit_kwargs):
+        context = mp.get_context('spawn')
+        frame_shape = frame_shape or probe_frame_shape(source) # native resolution and aspect ratio of the source
+        self._frames = SharedRing(frame_slots, frame_shape)
+        self._faces = SharedRing(face_slots, face_shape)
+        # Queues are kept on self: spawned children unpickle them after start() returns, and a garbage-collected
+        # queue unlinks its semaphores before they can attach
+        self._free_frames, self._free_faces = _free_queue(context, frame_slots), _free_queue(context, face_slots)
+        self._to_fit, self._to_encode = context.Queue(maxsize=frame_slots), context.Queue(maxsize=face_slots) # bounded by the ring sizes
+        self._gazepoint = context.Array('i', [-1, -1])
+        self._gazepoint_time = context.Value('d', 0.0, lock=False) # guarded by the gazepoint lock
+        self._stop = context.Event()
+        self.counters = {name: context.Value('q', 0) for name in COUNTERS}
+        fit_kwargs.setdefault('size', face_shape[1::-1])
+
+        self._stages = [
+            context.Process(target=_capture_stage, name='capture', daemon=True,
+                            args=(source, self._frames.attach_args(), self._free_frames, self._to_fit, self._gazepoint, self._gazepoint_time, self._stop, self.counters)),
+            context.Process(target=_fit_stage, name='fit', daemon=True,
+                            args=(self._frames.attach_args(), self._faces.attach_args(), self._free_frames, self._free_faces,
+                                  self._to_fit, self._to_encode, self.counters, fit_kwargs)),
+            context.Process(target=_encode_stage, name='encode', daemon=True,
+                            args=(self._faces.attach_args(), self._free_faces, self._to_encode, base, prefix, self.counters, save_kwargs or {})),
+        ]
+        self._start_time = None
+        self._closed = False
+
+    def start(self):
+        for stage in self._stages:
+            stage.start()
+        self._start_time = time.monotonic()
+        return self
+
+    def set_gazepoint(self, point):
+        """Label frames captured from now on with point (None for unlabelled frames)"""
+        with self._gazepoint.get_lock():
+            self._gazepoint[:] = list(point) if point is not None else [-1, -1]
+            self._gazepoint_time.value = time.monotonic()
+
+    def failed_stages(self):
+        """{stage name: exitcode} of the stage processes that exited with an error"""
+        return {stage.name: stage.exitcode for stage in self._stages if stage.exitcode not in (None, 0)}
+
+    def stats(self):
+        """Counts and per-second rates of every stage counter, and the stages that died"""
+        elapsed = time.monotonic() - self._start_time if self._start_time else 0.0
+        counts = {name: counter.value for name, counter in self.counters.items()}
+        rates = {f'{name}_per_s': (count / elapsed if elapsed else 0.0) for name, count in counts.items()}
+        return {'elapsed': elapsed, **counts, **rates, 'failed_stages': self.failed_stages()}
+
+    def close(self, timeout=30.0):
+        """Stop capturing, let the queued frames drain through the later stages and release the shared memory"""
+        if self._closed:
+            return self.stats()
+        self._closed = True
+        self._stop.set()
+        for stage in self._stages:
+            stage.join(timeout=timeout)
+            if stage.is_alive():
+                stage.terminate()
+                stage.join()
+        failed = self.failed_stages()
+        if failed:
+            print(f"Pipeline stages exited with errors: {failed}")
+        for ring in (self._frames, self._faces):
+            ring.close()
+            ring.unlink()
+        return self.stats()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
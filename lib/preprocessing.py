@@ -2,11 +2,22 @@ import numpy as np
 import cv2
 
 
-def generate_landmark_image(landmarks, size):
+def generate_landmark_image(landmarks, size, dtype=np.float64):
     """Create binary array representing target facial landmarks"""
-    base = np.zeros((size[0], size[1]))
-    for landmark in landmarks:
-        x, y = landmark
-        base[y][x] = 1
+    base = np.zeros((size[0], size[1]), dtype=dtype)
+    landmarks = np.asarray(landmarks, dtype=int).reshape(-1, 2)
+    base[landmarks[:, 1], landmarks[:, 0]] = 1
     return base
-    
+
+
+def sharpness(frame, points, padding=5):
+    """Variance of the Laplacian of the grayscale region around points. Higher is sharper"""
+    points = np.asarray(points, dtype=int).reshape(-1, 2)
+    x0, y0 = np.maximum(points.min(axis=0) - padding, 0)
+    x1, y1 = points.max(axis=0) + padding + 1
+    region = frame[y0:y1, x0:x1]
+    if region.size == 0:
+        return 0.0
+    if region.ndim == 3:
+        region = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(region, cv2.CV_64F).var())
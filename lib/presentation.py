@@ -0,0 +1,223 @@
+"""
+Stimulus presentation for the calibration sequence.
+The fullscreen window is created once, and between stimuli only the dirty regions (the previous dot and the
+overlay text band) of the persistent canvas are cleared and redrawn instead of refilling the whole frame.
+Dot onset, keypress and frame capture are timestamped with time.monotonic(), the same clock FrameGrabber uses,
+so the capture lag relative to the keypress can be checked for every sample.
+
+Display and key input go through a display object so the acquisition loop can also run headless:
+1. Display         : OpenCV HighGUI windows and keyboard
+2. HeadlessDisplay : draws nothing, keys come from a scripted sequence (see load_key_script)
+Acceptance notifications go through a notifier (winsound beep, terminal bell or nothing).
+"""
+import sys
+import time
+import cv2
+import numpy as np
+
+KEY_NAMES = {'enter': 13, 'esc': 27, 'space': 32}
+NO_KEY = -1
+
+
+class StimulusWindow():
+    """Fullscreen dot display with onset/keypress timestamps"""
+    def __init__(self, name="Calibration", screen_width=1920, screen_height=1080, dot_radius=4, dot_color=(0, 0, 255), overlay_height=60):
+        self.name = name
+        self.dot_radius = dot_radius
+        self.dot_color = dot_color # Full red color
+        self.canvas = np.zeros((screen_height, screen_width, 3), dtype=np.uint8)
+        self._overlay_top = screen_height - overlay_height # text band at the bottom of the screen
+        self._dot = None
+        self._overlay_drawn = False
+        self._pending_key = None # (key, time) read while painting a dot, handed out by the next wait_key
+
+        cv2.namedWindow(name, cv2.WINDOW_NORMAL)
+        cv2.setWindowProperty(name, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+
+    def _clear_dot(self):
+        if self._dot is None:
+            return
+        x, y = self._dot
+        r = self.dot_radius + 1
+        self.canvas[max(y - r, 0):y + r + 1, max(x - r, 0):x + r + 1] = 0
+
+    def show_dot(self, point, overlay_lines=None):
+        """Move the dot to point and return its onset time"""
+        self._clear_dot()
+        if overlay_lines or self._overlay_drawn:
+            self.canvas[self._overlay_top:] = 0
+            self._overlay_drawn = bool(overlay_lines)
+            for i, line in enumerate(overlay_lines or []):
+                cv2.putText(self.canvas, line, (20, self._overlay_top + 20 + 25 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (128, 128, 128), 1)
+        cv2.circle(self.canvas, tuple(point), self.dot_radius, self.dot_color, -1)
+        self._dot = tuple(point)
+        cv2.imshow(self.name, self.canvas)
+        key = cv2.waitKey(1) # let HighGUI paint the frame before stamping the onset
+        onset = time.monotonic()
+        if key != -1: # a fast response was read while painting, keep it for wait_key instead of losing it
+            self._pending_key = (key & 0xFF, onset)
+        return onset
+
+    def wait_key(self):
+        """Block until a key is pressed. Returns (key, keypress time)"""
+        if self._pending_key is not None:
+            pending, self._pending_key = self._pending_key, None
+            return pending
+        key = cv2.waitKey(0) & 0xFF
+        return key, time.monotonic()
+
+    def close(self):
+        cv2.destroyWindow(self.name)
+
+
+class Display():
+    """OpenCV windows and keyboard input"""
+    def show(self, name, image, fullscreen=False):
+        if fullscreen:
+            cv2.namedWindow(name, cv2.WINDOW_NORMAL)
+            cv2.setWindowProperty(name, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+        cv2.imshow(name, image)
+
+    def wait_key(self, delay=0):
+        """Wait up to delay ms for a key (0 blocks). Returns (key or NO_KEY, time)"""
+        key = cv2.waitKey(delay)
+        return (key & 0xFF if key != -1 else NO_KEY), time.monotonic()
+
+    def idle(self, delay):
+        """Keep the windows responsive for delay ms without reading a key"""
+        cv2.waitKey(delay)
+
+    def stimulus(self, name, screen_width, screen_height, **kwargs):
+        return StimulusWindow(name, screen_width, screen_height, **kwargs)
+
+    def close(self):
+        cv2.destroyAllWindows()
+
+
+class HeadlessDisplay():
+    """Display without windows. Every wait_key consumes the next entry of the key script; blocking waits
+       (delay 0) skip NO_KEY entries. Once the script is exhausted every wait returns esc."""
+    def __init__(self, keys):
+        self._keys = list(keys)
+        self._pos = 0
+
+    def show(self, name, image, fullscreen=False):
+        pass
+
+    def wait_key(self, delay=0):
+        while self._pos < len(self._keys):
+            key = self._keys[self._pos]
+            self._pos += 1
+            if key != NO_KEY or delay:
+                return key, time.monotonic()
+        return KEY_NAMES['esc'], time.monotonic()
+
+    def idle(self, delay):
+        time.sleep(delay / 1000)
+
+    def stimulus(self, name, screen_width, screen_height, **kwargs):
+        return _HeadlessStimulus(self)
+
+    def close(self):
+        pass
+
+
+class _HeadlessStimulus():
+    def __init__(self, display):
+        self._display = display
+
+    def show_dot(self, point, overlay_lines=None):
+        return time.monotonic()
+
+    def wait_key(self):
+        return self._display.wait_key(0)
+
+    def close(self):
+        pass
+
+
+def parse_key_script(lines):
+    """Expand key script lines into key codes. One entry per line:
+       'enter', 'esc', 'space', a single character or a key code; 'name*N' repeats a key N times;
+       'wait N' is N polls without a key press. Blank lines and '#' comments are ignored."""
+    keys = []
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith('wait'):
+            keys += [NO_KEY] * int(line.split()[1])
+            continue
+        name, _, count = line.partition('*')
+        name = name.strip()
+        key = KEY_NAMES.get(name.lower(), ord(name) if len(name) == 1 else None)
+        key = int(name) if key is None else key
+        keys += [key] * int(count or 1)
+    return keys
+
+
+def load_key_script(path):
+    with open(path) as file:
+        return parse_key_script(file)
+
+
+class BeepNotifier():
+    """winsound beep (Windows only, winsound is imported on creation)"""
+    def __init__(self, frequency=1000, duration=500):
+        import winsound
+        self._winsound = winsound
+        self.frequency, self.duration = frequency, duration
+
+    def notify(self):
+        self._winsound.Beep(self.frequency, self.duration)
+
+
+class BellNotifier():
+    """Terminal bell"""
+    def notify(self):
+        sys.stdout.write('\a')
+        sys.stdout.flush()
+
+
+class NullNotifier():
+    def notify(self):
+        pass
+
+
+def make_notifier(kind='auto'):
+    """'beep', 'bell', 'none' or 'auto' (beep where winsound is available, bell otherwise)"""
+    if kind == 'auto':
+        try:
+            return BeepNotifier()
+        except ImportError:
+            return BellNotifier()
+    return {'beep': BeepNotifier, 'bell': BellNotifier, 'none': NullNotifier}[kind]()
+
+
+class LatencyTracker():
+    """Per-sample dot onset -> keypress -> capture timing. Samples whose frame was captured more than
+       max_capture_lag seconds away from the keypress are flagged."""
+    def __init__(self, max_capture_lag=0.05):
+        self.max_capture_lag = max_capture_lag
+        self.records = []
+
+    def record(self, onset, keypress, capture):
+        timing = {
+            'onset': onset,
+            'keypress': keypress,
+            'capture': capture,
+            'reaction_ms': (keypress - onset) * 1000,
+            'capture_lag_ms': (capture - keypress) * 1000 if capture is not None else None, # negative: frame grabbed before the keypress registered
+        }
+        timing['flagged'] = capture is None or abs(capture - keypress) > self.max_capture_lag
+        self.records.append(timing)
+        return timing
+
+    def summary(self):
+        if not self.records:
+            return {}
+        reaction = np.array([record['reaction_ms'] for record in self.records])
+        lag = np.array([abs(record['capture_lag_ms']) for record in self.records if record['capture_lag_ms'] is not None] or [np.nan])
+        return {'samples': len(self.records), 'flagged': sum(record['flagged'] for record in self.records),
+                'reaction_ms_p50': float(np.percentile(reaction, 50)), 'reaction_ms_p95': float(np.percentile(reaction, 95)),
+                'capture_lag_ms_p50': float(np.nanpercentile(lag, 50)), 'capture_lag_ms_p95': float(np.nanpercentile(lag, 95))}
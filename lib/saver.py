@@ -0,0 +1,83 @@
+"""
+Write-behind saver for Face objects.
+Face.save is handed off to a pool of worker threads through a bounded queue, so the calibration loop
+can show the next stimulus as soon as detection and fitting are done. When the queue is full, submit()
+blocks (backpressure) instead of letting memory grow without bound.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class AsyncSaver():
+    """Save Face objects asynchronously with a bounded queue and a pool of worker threads.
+       Each submitted sample gets a Future which carries the exception raised while saving it (if any).
+    """
+    def __init__(self, num_workers=2, max_queue=32, on_error=None):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._on_error = on_error # callback(filename, exception)
+        self._lock = threading.Lock()
+        self.errors = [] # List[Tuple[str, Exception]] of failed samples
+        self.saved = 0
+        self._closed = False
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, face, filename, **save_kwargs):
+        """Queue face.save(filename, **save_kwargs). Blocks while the queue is full."""
+        if self._closed:
+            raise RuntimeError("AsyncSaver is closed")
+        future = Future()
+        self._queue.put((face, filename, save_kwargs, future))
+        return future
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None: # shutdown sentinel
+                    return
+                face, filename, save_kwargs, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    face.save(filename, **save_kwargs)
+                except Exception as e:
+                    with self._lock:
+                        self.errors.append((filename, e))
+                    future.set_exception(e)
+                    if self._on_error is not None:
+                        self._on_error(filename, e)
+                else:
+                    with self._lock:
+                        self.saved += 1
+                    future.set_result(filename)
+            finally:
+                self._queue.task_done()
+
+    @property
+    def depth(self):
+        """Number of samples waiting to be written"""
+        return self._queue.qsize()
+
+    def flush(self):
+        """Block until every queued sample has been written"""
+        self._queue.join()
+
+    def close(self):
+        """Flush pending samples and stop the workers"""
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,151 @@
+"""
+Gaze point schedulers for the calibration sequence.
+A scheduler hands out the next onscreen target with next(), is told whether the sample at that target was
+accepted with report(), and returns None from next() once the session is complete.
+1. GridScheduler     : the original dense shuffled grid, failed points are put back at the tail of the queue
+2. CoverageScheduler : low-discrepancy (Halton) targets with per-region quotas, delayed retries for failed points
+                       and early termination as soon as every region reached its quota
+Accepted points can be appended to a progress file and replayed with resume() to continue an interrupted session.
+"""
+import json
+import math
+import os
+from collections import deque
+import numpy as np
+
+
+class GridScheduler():
+    """Shuffled dense grid with a gap of `gap` pixels. Every point has to be accepted once"""
+    def __init__(self, screen_width=1920, screen_height=1080, gap=10, seed=None):
+        points = [(x, y) for x in range(0, screen_width, gap) for y in range(0, screen_height, gap)]
+        np.random.default_rng(seed).shuffle(points) # Shuffle the points
+        self._queue = deque(points)
+        self.accepted = 0
+
+    def next(self):
+        return self._queue.popleft() if self._queue else None
+
+    def report(self, point, accepted):
+        if accepted:
+            self.accepted += 1
+        else:
+            self._queue.append(point) # retry at the tail
+
+    def resume(self, points):
+        """Drop points that were already accepted in a previous run"""
+        done = {tuple(point) for point in points}
+        self._queue = deque(point for point in self._queue if point not in done)
+        self.accepted += len(done)
+
+    @property
+    def done(self):
+        return not self._queue
+
+    @property
+    def remaining(self):
+        return len(self._queue)
+
+
+def _halton(index, base):
+    result, f = 0.0, 1.0
+    while index > 0:
+        f /= base
+        result += f * (index % base)
+        index //= base
+    return result
+
+
+class CoverageScheduler():
+    """Stratified low-discrepancy targets with a target sample count.
+       The screen is split into regions[0] x regions[1] regions which each need quota accepted samples.
+       Targets come from a randomly shifted 2D Halton sequence, skipping regions whose quota is already met.
+       A failed target is shown again after retry_delay other targets, and given up after max_retries failures
+       (its region stays under quota, so new targets are drawn there instead).
+    """
+    def __init__(self, screen_width=1920, screen_height=1080, target=500, regions=(4, 4), retry_delay=3, max_retries=2, margin=5, seed=None):
+        self.screen_width, self.screen_height = screen_width, screen_height
+        self.regions = regions # (columns, rows)
+        self.quota = math.ceil(target / (regions[0] * regions[1]))
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.margin = margin # keep targets this many pixels away from the screen edges
+        self._shift = np.random.default_rng(seed).random(2) # Cranley-Patterson rotation of the sequence
+        self._index = 0
+        self._counts = np.zeros((regions[1], regions[0]), dtype=int) # accepted samples per region
+        self._retries = deque() # (issue count at which the retry is due, point)
+        self._failures = {}
+        self._issued = 0
+        self.accepted = 0
+
+    def region(self, point):
+        col = min(point[0] * self.regions[0] // self.screen_width, self.regions[0] - 1)
+        row = min(point[1] * self.regions[1] // self.screen_height, self.regions[1] - 1)
+        return row, col
+
+    @property
+    def done(self):
+        return bool((self._counts >= self.quota).all())
+
+    def _candidate(self):
+        self._index += 1
+        u = (_halton(self._index, 2) + self._shift[0]) % 1.0
+        v = (_halton(self._index, 3) + self._shift[1]) % 1.0
+        x = self.margin + int(u * (self.screen_width - 2 * self.margin))
+        y = self.margin + int(v * (self.screen_height - 2 * self.margin))
+        return x, y
+
+    def next(self):
+        if self.done: # early termination once every region is covered
+            return None
+        self._issued += 1
+        while self._retries and self._retries[0][0] <= self._issued:
+            _, point = self._retries.popleft()
+            if self._counts[self.region(point)] < self.quota:
+                return point
+        while True:
+            point = self._candidate()
+            if self._counts[self.region(point)] < self.quota:
+                return point
+
+    def report(self, point, accepted):
+        if accepted:
+            self._counts[self.region(point)] += 1
+            self.accepted += 1
+            self._failures.pop(point, None)
+            return
+        failures = self._failures.get(point, 0) + 1
+        self._failures[point] = failures
+        if failures <= self.max_retries:
+            self._retries.append((self._issued + self.retry_delay, point))
+
+    def resume(self, points):
+        """Count samples accepted in a previous run towards the region quotas"""
+        for point in points:
+            self._counts[self.region(tuple(point))] += 1
+            self.accepted += 1
+        self._index += len(points) # continue the sequence instead of replaying the same targets
+
+    @property
+    def remaining(self):
+        return int(np.maximum(self.quota - self._counts, 0).sum())
+
+
+SCHEDULERS = {'grid': GridScheduler, 'coverage': CoverageScheduler}
+
+
+def make_scheduler(name, screen_width=1920, screen_height=1080, **kwargs):
+    return SCHEDULERS[name](screen_width, screen_height, **kwargs)
+
+
+def load_progress(path):
+    """Read accepted points from a progress file written by record_progress"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return [tuple(json.loads(line)) for line in file if line.strip()]
+
+
+def record_progress(path, point):
+    """Append an accepted point to the session progress file"""
+    with open(path, 'a') as file:
+        file.write(json.dumps(list(point)) + '\n')
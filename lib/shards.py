@@ -0,0 +1,260 @@
+"""
+Compact sharded container for acquired samples.
+Instead of ten small files per sample, samples are appended as raw uint8/int32 records into fixed-size shards.
+Each shard is a directory holding:
+1. faces.u8       : (n, H, W, C) uint8 face crops
+2. landmarks.i32  : (n, L, 2) int32 landmark coordinates
+3. gazepoint.i32  : (n, 2) int32 onscreen gaze targets
+4. eye_left.u8    : (n, h, w, C) uint8 fixed-size left eye patches
+5. eye_right.u8   : (n, h, w, C) uint8 fixed-size right eye patches
+6. index.npy      : per-sample name, whether eye patches were stored (zero patches otherwise) and the dot onset,
+                    keypress and capture times of the sample (NaN when unknown), see lib.presentation.LatencyTracker
+A meta.json at the dataset root lists the finalized shards. Samples only become readable once their shard is
+finalized, so callers that need to know when a sample is durable pass on_finalized to append(). Until then, every
+record is also appended to index.partial and the files are flushed, so a shard left unfinalized by a crash is
+recovered (finalized up to its last complete record) by the next ShardWriter on the same base. Its on_finalized
+callbacks are lost with the crashed process. Binary landmark images are not stored since they can be rebuilt from
+the coordinates.
+Shards written before eye patches had a fixed size (no 'eye_shape' in meta.json) keep the ragged eye crops
+in eyes.u8, located by byte offset and shape in index.npy. They can still be read but not appended to.
+"""
+import json
+import os
+import threading
+import numpy as np
+from lib.configs import EYE_PATCH_SIZE
+
+META_FILENAME = 'meta.json'
+PARTIAL_INDEX_FILENAME = 'index.partial'
+SHARD_FILES = (('faces', 'faces.u8'), ('landmarks', 'landmarks.i32'), ('gazepoint', 'gazepoint.i32'),
+               ('eye_left', 'eye_left.u8'), ('eye_right', 'eye_right.u8'))
+INDEX_DTYPE = np.dtype([('name', 'U64'), ('has_eyes', np.bool_),
+                        ('onset', np.float64), ('keypress', np.float64), ('capture', np.float64)])
+TIMING_FIELDS = ('onset', 'keypress', 'capture')
+
+
+class ShardWriter():
+    """Append Face objects into fixed-size shards under base. Writes are sequential appends only."""
+    def __init__(self, base='./data/shards', shard_size=1024, face_shape=(244, 244, 3), num_landmarks=39,
+                 eye_shape=(EYE_PATCH_SIZE[1], EYE_PATCH_SIZE[0], 3)):
+        self.base = base
+        self.shard_size = shard_size
+        os.makedirs(base, exist_ok=True)
+        self._lock = threading.Lock()
+        self._meta = self._load_meta(face_shape, num_landmarks, eye_shape)
+        self.recovered = self._recover() # names of the crashed shards finalized on open
+        self._empty_eye = np.zeros(eye_shape, dtype=np.uint8)
+        self._files = None
+        self._index = []
+        self._on_finalized = [] # callbacks of the samples in the open shard
+
+    def _load_meta(self, face_shape, num_landmarks, eye_shape):
+        path = os.path.join(self.base, META_FILENAME)
+        if os.path.exists(path): # Continue an existing dataset with a fresh shard
+            with open(path) as file:
+                meta = json.load(file)
+            if tuple(meta['face_shape']) != tuple(face_shape) or meta['num_landmarks'] != num_landmarks or \
+               tuple(meta.get('eye_shape', ())) != tuple(eye_shape):
+                raise ValueError(f"Existing shards in {self.base} were written with a different sample layout")
+            return meta
+        return {'face_shape': list(face_shape), 'num_landmarks': num_landmarks, 'eye_shape': list(eye_shape), 'shards': []}
+
+    def _record_sizes(self):
+        """Bytes per record in each shard file"""
+        face_size = int(np.prod(self._meta['face_shape']))
+        eye_size = int(np.prod(self._meta['eye_shape']))
+        return {'faces': face_size, 'landmarks': self._meta['num_landmarks'] * 2 * 4, 'gazepoint': 2 * 4,
+                'eye_left': eye_size, 'eye_right': eye_size}
+
+    def _recover(self):
+        """Finalize shard directories left behind by a crashed writer, up to their last record that was written
+           completely to every file. Shards without a partial index (e.g. not a single record flushed) are left alone."""
+        listed = {shard['name'] for shard in self._meta['shards']}
+        sizes = self._record_sizes()
+        recovered = []
+        for name in sorted(os.listdir(self.base)):
+            shard_dir = os.path.join(self.base, name)
+            partial_path = os.path.join(shard_dir, PARTIAL_INDEX_FILENAME)
+            if not name.startswith('shard_') or name in listed or not os.path.exists(partial_path):
+                continue
+            index = np.fromfile(partial_path, dtype=INDEX_DTYPE)
+            count = min([len(index)] + [os.path.getsize(os.path.join(shard_dir, filename)) // sizes[key]
+                                        for key, filename in SHARD_FILES])
+            if count == 0:
+                continue
+            for key, filename in SHARD_FILES: # drop a torn trailing record
+                os.truncate(os.path.join(shard_dir, filename), count * sizes[key])
+            np.save(os.path.join(shard_dir, 'index.npy'), index[:count])
+            os.remove(partial_path)
+            self._meta['shards'].append({'name': name, 'count': int(count)})
+            recovered.append(name)
+        if recovered:
+            self._write_meta()
+            print(f"Recovered unfinalized shards {recovered} in {self.base}")
+        return recovered
+
+    def _write_meta(self):
+        # Replace meta.json atomically so a crash never leaves a half-written listing
+        tmp_path = os.path.join(self.base, META_FILENAME + '.tmp')
+        with open(tmp_path, 'w') as file:
+            json.dump(self._meta, file)
+        os.replace(tmp_path, os.path.join(self.base, META_FILENAME))
+
+    def _open_shard(self):
+        number = len(self._meta['shards'])
+        while os.path.exists(os.path.join(self.base, f"shard_{number:05d}")): # never reopen a shard directory
+            number += 1
+        name = f"shard_{number:05d}"
+        shard_dir = os.path.join(self.base, name)
+        os.makedirs(shard_dir)
+        self._files = {key: open(os.path.join(shard_dir, filename), 'wb') for key, filename in SHARD_FILES}
+        self._files['index'] = open(os.path.join(shard_dir, PARTIAL_INDEX_FILENAME), 'wb')
+        self._shard_name = name
+        self._index = []
+        self._on_finalized = []
+
+    def append(self, face, name, on_finalized=None):
+        """Append a fitted Face object as a single record. Returns its shard, index and byte offsets.
+           on_finalized(location) is called once the shard holding the record has been finalized (index.npy
+           and meta.json written), i.e. when the sample can actually be read back."""
+        frame = np.ascontiguousarray(face.frame, dtype=np.uint8)
+        if list(frame.shape) != self._meta['face_shape']:
+            raise ValueError(f"Face frame of shape {frame.shape} does not match shard layout {self._meta['face_shape']}")
+        landmarks = np.asarray(face.landmarks, dtype=np.int32).reshape(-1, 2)
+        if len(landmarks) != self._meta['num_landmarks']:
+            raise ValueError(f"Expected {self._meta['num_landmarks']} landmarks, got {len(landmarks)}")
+        gazepoint = np.asarray(face.gazepoint if face.gazepoint is not None else (-1, -1), dtype=np.int32)
+        if face.eyes: # fixed-size patches, see lib.eye.Eye
+            eyes = [np.ascontiguousarray(eye.frame, dtype=np.uint8) for eye in face.eyes]
+            if any(list(eye.shape) != self._meta['eye_shape'] for eye in eyes):
+                raise ValueError(f"Eye patches of shape {[eye.shape for eye in eyes]} do not match shard layout {self._meta['eye_shape']}")
+        else: # samples without eye patches get zero patches
+            eyes = [self._empty_eye, self._empty_eye]
+
+        with self._lock:
+            if self._files is None:
+                self._open_shard()
+            local = len(self._index)
+            self._files['faces'].write(frame.tobytes())
+            self._files['landmarks'].write(landmarks.tobytes())
+            self._files['gazepoint'].write(gazepoint.tobytes())
+            self._files['eye_left'].write(eyes[0].tobytes())
+            self._files['eye_right'].write(eyes[1].tobytes())
+            location = {'shard': self._shard_name, 'index': local, 'face_offset': local * frame.nbytes,
+                        'eye_left_offset': local * eyes[0].nbytes, 'eye_right_offset': local * eyes[1].nbytes}
+            timing = face.timing or {}
+            self._index.append((name, bool(face.eyes), *(np.nan if timing.get(key) is None else timing[key] for key in TIMING_FIELDS)))
+            self._files['index'].write(np.array(self._index[-1:], dtype=INDEX_DTYPE).tobytes())
+            for file in self._files.values(): # a crashed process still leaves every complete record on disk
+                file.flush()
+            if on_finalized is not None:
+                self._on_finalized.append((on_finalized, location))
+            if len(self._index) >= self.shard_size:
+                self._finalize_shard()
+        return location
+
+    def _finalize_shard(self):
+        for file in self._files.values():
+            file.close()
+        shard_dir = os.path.join(self.base, self._shard_name)
+        np.save(os.path.join(shard_dir, 'index.npy'), np.array(self._index, dtype=INDEX_DTYPE))
+        os.remove(os.path.join(shard_dir, PARTIAL_INDEX_FILENAME))
+        self._meta['shards'].append({'name': self._shard_name, 'count': len(self._index)})
+        self._write_meta()
+        self._files = None
+        self._index = []
+        callbacks, self._on_finalized = self._on_finalized, []
+        for callback, location in callbacks:
+            callback(location)
+
+    def close(self):
+        with self._lock:
+            if self._files is not None:
+                if self._index:
+                    self._finalize_shard()
+                else:
+                    for file in self._files.values():
+                        file.close()
+                    self._files = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardReader():
+    """Random access over a sharded dataset. Arrays are np.memmap views, nothing is copied until accessed."""
+    def __init__(self, base='./data/shards'):
+        self.base = base
+        with open(os.path.join(base, META_FILENAME)) as file:
+            self.meta = json.load(file)
+        face_shape = tuple(self.meta['face_shape'])
+        num_landmarks = self.meta['num_landmarks']
+        self.eye_shape = tuple(self.meta['eye_shape']) if 'eye_shape' in self.meta else None # None: legacy ragged eye crops
+
+        self._shards = []
+        for shard in self.meta['shards']:
+            shard_dir = os.path.join(base, shard['name'])
+            count = shard['count']
+            arrays = {
+                'faces': np.memmap(os.path.join(shard_dir, 'faces.u8'), dtype=np.uint8, mode='r', shape=(count, *face_shape)),
+                'landmarks': np.memmap(os.path.join(shard_dir, 'landmarks.i32'), dtype=np.int32, mode='r', shape=(count, num_landmarks, 2)),
+                'gazepoint': np.memmap(os.path.join(shard_dir, 'gazepoint.i32'), dtype=np.int32, mode='r', shape=(count, 2)),
+                'index': np.load(os.path.join(shard_dir, 'index.npy')),
+            }
+            if self.eye_shape is not None:
+                for side in ('eye_left', 'eye_right'):
+                    arrays[side] = np.memmap(os.path.join(shard_dir, f'{side}.u8'), dtype=np.uint8, mode='r', shape=(count, *self.eye_shape))
+            else:
+                arrays['eyes'] = self._open_eyes(os.path.join(shard_dir, 'eyes.u8'))
+            self._shards.append(arrays)
+        # Global sample index -> (shard, local index)
+        self._starts = np.cumsum([0] + [shard['count'] for shard in self.meta['shards']])
+
+    def _open_eyes(self, path):
+        if os.path.getsize(path) == 0: # np.memmap refuses empty files
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def _locate(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Sample index {idx} out of range")
+        shard_idx = int(np.searchsorted(self._starts, idx, side='right')) - 1
+        return self._shards[shard_idx], idx - int(self._starts[shard_idx])
+
+    def _eye(self, eyes, offset, shape):
+        size = int(np.prod(shape))
+        return eyes[offset:offset + size].reshape(tuple(shape))
+
+    def __getitem__(self, idx):
+        """Sample dict. eye_left/eye_right are (h, w, C) patches (zeros where has_eyes is False)"""
+        shard, local = self._locate(idx)
+        record = shard['index'][local]
+        sample = {
+            'name': str(record['name']),
+            'face': shard['faces'][local],
+            'landmarks': shard['landmarks'][local],
+            'gazepoint': shard['gazepoint'][local],
+        }
+        if 'onset' in record.dtype.names and not all(np.isnan(record[key]) for key in TIMING_FIELDS):
+            sample['timing'] = {key: (None if np.isnan(record[key]) else float(record[key])) for key in TIMING_FIELDS}
+        else:
+            sample['timing'] = None
+        if self.eye_shape is not None:
+            sample.update(eye_left=shard['eye_left'][local], eye_right=shard['eye_right'][local], has_eyes=bool(record['has_eyes']))
+        else:
+            sample.update(eye_left=self._eye(shard['eyes'], record['eye_left_offset'], record['eye_left_shape']),
+                          eye_right=self._eye(shard['eyes'], record['eye_right_offset'], record['eye_right_shape']),
+                          has_eyes=bool(record['eye_left_shape'][0]))
+        return sample
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
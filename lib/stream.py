@@ -0,0 +1,150 @@
+"""
+Continuous capture ('stream' mode).
+Frames are captured at the camera's native rate straight into a preallocated ring buffer of uint8 frames with
+monotonic timestamps. Two consumers drain the ring independently:
+1. an encoder which writes frames to disk in bulk batches (one video file plus a timestamp array)
+2. a detector which runs FaceEstimator.inspect on the newest frame and is allowed to lag behind
+"""
+import json
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+
+class FrameRing():
+    """Fixed-capacity ring of uint8 frames. Sequence numbers increase monotonically, slot = seq % capacity"""
+    def __init__(self, capacity, shape):
+        self.capacity = capacity
+        self.frames = np.empty((capacity, *shape), dtype=np.uint8)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.head = 0 # sequence number of the next frame to be written
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def slot(self, seq):
+        return seq % self.capacity
+
+    def commit(self, timestamp):
+        """Publish the frame that was written into slot(head)"""
+        with self._cond:
+            self.timestamps[self.slot(self.head)] = timestamp
+            self.head += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def wait(self, seq, timeout=0.5):
+        """Wait until frame seq has been committed or the ring is closed. Returns the current head"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.head > seq or self.closed, timeout=timeout)
+            return self.head
+
+    def copy(self, start, stop):
+        """Copy frames [start, stop) out of the ring. Returns (frames, timestamps, first valid seq)"""
+        with self._cond:
+            start = max(start, self.head - self.capacity + 1) # oldest slot may be overwritten at any moment
+            slots = [self.slot(seq) for seq in range(start, stop)]
+            return self.frames[slots], self.timestamps[slots], start
+
+
+def _encode(ring, writer, batch_size, stats):
+    seq = 0
+    while True:
+        head = ring.wait(seq + batch_size - 1)
+        if head <= seq:
+            if ring.closed:
+                return
+            continue
+        if head - seq < batch_size and not ring.closed:
+            continue
+        frames, _, first = ring.copy(seq, head)
+        stats['encoder_dropped'] += first - seq # frames overwritten before they could be encoded
+        for frame in frames:
+            writer.write(frame)
+        stats['encoded'] += len(frames)
+        seq = head
+
+
+def _detect(ring, estimator, log, stats):
+    seq = 0
+    while True:
+        head = ring.wait(seq)
+        if head <= seq:
+            if ring.closed:
+                return
+            continue
+        latest = head - 1 # always jump to the newest frame, skipping whatever arrived meanwhile
+        frames, timestamps, _ = ring.copy(latest, head)
+        face = estimator.inspect(frames[0], track=True)
+        lag = ring.timestamps[ring.slot(ring.head - 1)] - timestamps[0] # how far behind capture the result is
+        stats['processed'] += 1
+        stats['lag'].append(lag)
+        if face:
+            stats['faces'] += 1
+        log.write(json.dumps({'frame': int(latest), 'timestamp': float(timestamps[0]),
+                              'boundingbox': face.boundingbox if face else None,
+                              'landmarks': face.landmarks.tolist() if face else None}) + '\n')
+        seq = head
+
+
+def run_stream(estimator, name, duration=10, source=0, base='./data/stream', ring_seconds=2.0, batch_size=30):
+    """Capture from source for duration seconds. Returns a summary of achieved fps, dropped frames and consumer lag"""
+    os.makedirs(base, exist_ok=True)
+    cap = cv2.VideoCapture(source)
+    ret, frame = cap.read()
+    if not ret:
+        cap.release()
+        raise RuntimeError(f"Unable to read from video source {source}")
+    native_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+    ring = FrameRing(max(int(native_fps * ring_seconds), batch_size * 2), frame.shape)
+    writer = cv2.VideoWriter(os.path.join(base, f'{name}.mp4'), cv2.VideoWriter_fourcc(*'mp4v'), native_fps, (frame.shape[1], frame.shape[0]))
+    stats = {'encoded': 0, 'encoder_dropped': 0, 'processed': 0, 'faces': 0, 'lag': []}
+    timestamps = []
+
+    with open(os.path.join(base, f'{name}_landmarks.jsonl'), 'w') as log:
+        consumers = [threading.Thread(target=_encode, args=(ring, writer, batch_size, stats)),
+                     threading.Thread(target=_detect, args=(ring, estimator, log, stats))]
+        for consumer in consumers:
+            consumer.start()
+
+        start = time.monotonic()
+        while time.monotonic() - start < duration:
+            out = ring.frames[ring.slot(ring.head)]
+            ret, image = cap.read(out) # decode directly into the ring slot
+            timestamp = time.monotonic()
+            if not ret:
+                break
+            if image is not out: # driver returned a new buffer (e.g. resolution change)
+                out[...] = image
+            ring.commit(timestamp)
+            timestamps.append(timestamp)
+        ring.close()
+        for consumer in consumers:
+            consumer.join()
+    cap.release()
+    writer.release()
+    np.save(os.path.join(base, f'{name}_timestamps.npy'), np.array(timestamps))
+
+    # Frames the camera itself skipped show up as gaps longer than 1.5 frame intervals
+    intervals = np.diff(timestamps) if len(timestamps) > 1 else np.zeros(0)
+    camera_dropped = int(np.sum(np.maximum(np.round(intervals * native_fps) - 1, 0)[intervals > 1.5 / native_fps]))
+    elapsed = timestamps[-1] - timestamps[0] if len(timestamps) > 1 else 0.0
+    lag = np.array(stats['lag']) if stats['lag'] else np.zeros(1)
+    return {
+        'captured': len(timestamps),
+        'native_fps': native_fps,
+        'achieved_fps': (len(timestamps) - 1) / elapsed if elapsed else 0.0,
+        'camera_dropped': camera_dropped,
+        'encoded': stats['encoded'],
+        'encoder_dropped': stats['encoder_dropped'],
+        'processed': stats['processed'],
+        'faces': stats['faces'],
+        'consumer_lag_mean': float(lag.mean()),
+        'consumer_lag_max': float(lag.max()),
+    }
@@ -10,10 +10,10 @@ def visualize(frame, points=None, dot_size=2):
     dot_image = frame.copy()
     
     # Iterate through each landmark point
-    if points:
-        for landmark in points:  # Assuming 'points' is the list of landmarks
+    if points is not None:
+        for landmark in points:  # Assuming 'points' is the (N, 2) array of landmarks
             # Draw each point on the image
-            dot_image = cv2.circle(dot_image, (landmark[0], landmark[1]), dot_size, dot_color, -1)
+            dot_image = cv2.circle(dot_image, (int(landmark[0]), int(landmark[1])), dot_size, dot_color, -1)
         
     # Display the image with landmarks
     cv2.imshow("Labeled Image", dot_image)
@@ -1,21 +1,28 @@
 import os
 
+def make_dirs(data_dir):
+    """Create the sample subdirectories Face.save writes into under data_dir"""
+    face_frame_dir = os.path.join(data_dir, 'face_image') 
+    face_lm_dir = os.path.join(data_dir, 'landmark_coordinates') 
+    face_lm_img_dir = os.path.join(data_dir, 'face_binary')
+    lefteye_frame_dir = os.path.join(data_dir, 'eye_image_left') 
+    righteye_frame_dir = os.path.join(data_dir, 'eye_image_right') 
+    gazepoint_dir = os.path.join(data_dir, 'gazepoint')
+    latency_dir = os.path.join(data_dir, 'latency')
+    
+    # Confirm directory existence, else create new 
+    os.makedirs(face_frame_dir, exist_ok=True)
+    os.makedirs(face_lm_img_dir, exist_ok=True)
+    os.makedirs(face_lm_dir, exist_ok=True)
+    os.makedirs(lefteye_frame_dir, exist_ok=True)
+    os.makedirs(righteye_frame_dir, exist_ok=True)
+    os.makedirs(gazepoint_dir, exist_ok=True)
+    os.makedirs(latency_dir, exist_ok=True)
+
+
 def main(base):
     try:
-        face_frame_dir = os.path.join(base, 'data', 'face_image') 
-        face_lm_dir = os.path.join(base, 'data', 'landmark_coordinates') 
-        face_lm_img_dir = os.path.join(base, 'data', 'face_binary')
-        lefteye_frame_dir = os.path.join(base, 'data', 'eye_image_left') 
-        righteye_frame_dir = os.path.join(base, 'data', 'eye_image_right') 
-        gazepoint_dir = os.path.join(base, 'data', 'gazepoint')
-        
-        # Confirm directory existence, else create new 
-        os.makedirs(face_frame_dir, exist_ok=True)
-        os.makedirs(face_lm_img_dir, exist_ok=True)
-        os.makedirs(face_lm_dir, exist_ok=True)
-        os.makedirs(lefteye_frame_dir, exist_ok=True)
-        os.makedirs(righteye_frame_dir, exist_ok=True)
-        os.makedirs(gazepoint_dir, exist_ok=True)
+        make_dirs(os.path.join(base, 'data'))
 
         print(f"Data directories are created in {base}")
     except:
@@ -0,0 +1,90 @@
+"""
+Headless end-to-end replay of the calibration sequence.
+Runs frame_acquisition.main over a recorded video (VideoReplay) with keypresses from a key script
+(HeadlessDisplay) and no sound, so end-to-end throughput can be measured on any machine:
+1. accepted samples per minute, including draining the save queue
+2. reject rate and reject reasons
+3. per-stage time (p50/p95/mean) from the session metrics log
+
+Key script: one entry per line, e.g.
+    x          # dismiss the instructions
+    wait 30    # 30 preview frames without a keypress
+    enter      # start the calibration sequence
+    enter*100  # 100 samples
+    esc
+Without --keys, the script 'x, wait 10, enter, enter*<samples>, esc' is used.
+"""
+import argparse
+import json
+import os
+from collections import defaultdict
+import numpy as np
+import prep_directory
+from frame_acquisition import main as acquisition_main
+from lib.capture import VideoReplay
+from lib.presentation import HeadlessDisplay, load_key_script, parse_key_script
+
+
+def stage_summary(metrics_path):
+    """Per-stage timings and reject reasons from a .jsonl metrics log"""
+    durations, reasons = defaultdict(list), defaultdict(int)
+    with open(metrics_path) as file:
+        for line in file:
+            record = json.loads(line)
+            for name, (_, duration) in record['stages'].items():
+                durations[name].append(duration)
+            if record['event'] == 'sample' and record['outcome'] == 'rejected':
+                reasons[record['reason']] += 1
+    stages = {name: {'p50_ms': float(np.percentile(values, 50)), 'p95_ms': float(np.percentile(values, 95)),
+                     'mean_ms': float(np.mean(values)), 'count': len(values)} for name, values in durations.items()}
+    return stages, dict(reasons)
+
+
+def main(video, keys=None, samples=50, base='./data/replay', fps=None, output='replay_report.json', **acquisition_kwargs):
+    keys = load_key_script(keys) if keys else parse_key_script(['x', 'wait 10', 'enter', f'enter*{samples}', 'esc'])
+    prep_directory.make_dirs(base)
+    metrics_path = os.path.join(base, 'replay_metrics.jsonl')
+    if os.path.exists(metrics_path): # the metrics log is appended to, start from a clean one
+        os.remove(metrics_path)
+
+    summary = acquisition_main('replay', source=VideoReplay(video, fps=fps), display=HeadlessDisplay(keys), notifier='none',
+                               base=base, metrics_path=metrics_path, **acquisition_kwargs)
+    stages, reasons = stage_summary(metrics_path)
+    attempts = summary['accepted'] + summary['rejected']
+    report = {
+        'video': video,
+        'accepted': summary['accepted'],
+        'rejected': summary['rejected'],
+        'elapsed_s': summary['elapsed'],
+        'accepted_per_min': summary['accepted'] / summary['elapsed'] * 60 if summary['elapsed'] else 0.0,
+        'reject_rate': summary['rejected'] / attempts if attempts else 0.0,
+        'reject_reasons': reasons,
+        'stages': stages,
+        'latency': summary['latency'],
+        'capture': summary['capture'],
+    }
+    print(f"{report['accepted']} accepted, {report['rejected']} rejected ({report['reject_rate']:.1%}) in {report['elapsed_s']:.1f} s: "
+          f"{report['accepted_per_min']:.1f} samples/min")
+    for name, stats in stages.items():
+        print(f"{name:<10} p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms  mean {stats['mean_ms']:8.2f} ms  (n={stats['count']})")
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded video through the calibration sequence headless")
+    parser.add_argument('video')
+    parser.add_argument('--keys', default=None, help="key script file")
+    parser.add_argument('--samples', type=int, default=50, help="number of Enter presses when no key script is given")
+    parser.add_argument('--base', default='./data/replay')
+    parser.add_argument('--fps', type=float, default=None, help="pace frames like a live camera at this rate")
+    parser.add_argument('--output', default='replay_report.json')
+    parser.add_argument('--output-format', default='files', choices=['files', 'shards'])
+    parser.add_argument('--sync-save', action='store_true', help="save samples on the main thread")
+    parser.add_argument('--detector', default='hog')
+    parser.add_argument('--burst', action='store_true')
+    args = parser.parse_args()
+    main(args.video, args.keys, args.samples, args.base, args.fps, args.output, output_format=args.output_format,
+         async_save=not args.sync_save, detector=args.detector, burst=args.burst)
@@ -0,0 +1,155 @@
+"""
+Offline reprocessing of recorded sessions into samples.
+Runs FaceEstimator.inspect -> Face.fit -> Face.save over recorded video files (or directories of raw frame dumps)
+on a process pool, so a dataset can be regenerated after changing fit parameters or landmark indices without
+re-recording participants.
+
+Every source needs a gaze-label sidecar CSV with a 'frame,x,y' header:
+1. video file 'session.mp4'  -> 'session.csv', where frame is the frame index in the video
+2. frame dump directory 'dir' -> 'dir/gazepoints.csv', where frame is a filename inside the directory (.jpg/.png/.npy)
+
+Output filenames are derived from the source name and frame, so reruns are deterministic. Finished frames are
+appended to a progress log under the output directory and skipped when the run is resumed.
+"""
+import argparse
+import csv
+import multiprocessing as mp
+import os
+import time
+import cv2
+import numpy as np
+import prep_directory
+from lib.configs import MINIMUM_EAR
+
+PROGRESS_LOG = 'reprocess_progress.log'
+_estimator = None # per-worker FaceEstimator, loaded once by _init_worker
+
+
+def _init_worker():
+    global _estimator
+    from face_estimator import FaceEstimator
+    _estimator = FaceEstimator()
+
+
+def read_labels(source):
+    """Read the gaze-label sidecar of a source into a list of (frame, (x, y))"""
+    if os.path.isdir(source):
+        path, is_video = os.path.join(source, 'gazepoints.csv'), False
+    else:
+        path, is_video = os.path.splitext(source)[0] + '.csv', True
+    labels = []
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            frame = int(row['frame']) if is_video else row['frame']
+            labels.append((frame, (int(row['x']), int(row['y']))))
+    return sorted(labels)
+
+
+def sample_name(source, frame):
+    stem = os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+    frame = f'{frame:06d}' if isinstance(frame, int) else os.path.splitext(frame)[0]
+    return '_'.join([stem, frame])
+
+
+def _read_frames(source, frames):
+    """Yield (frame_key, image) for the requested frames of a source in order"""
+    if os.path.isdir(source):
+        for key in frames:
+            path = os.path.join(source, key)
+            yield key, np.load(path) if path.endswith('.npy') else cv2.imread(path)
+        return
+
+    cap = cv2.VideoCapture(source)
+    position = 0
+    try:
+        for index in frames:
+            if index != position: # seek only when frames are not consecutive
+                cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ret, image = cap.read()
+            position = index + 1
+            yield index, image if ret else None
+    finally:
+        cap.release()
+
+
+def _process_chunk(task):
+    """Worker entry point. Returns a list of (name, status) in the order of the chunk"""
+    source, labels, base, size, padding = task
+    gazepoints = dict(labels)
+    results = []
+    for key, image in _read_frames(source, [key for key, _ in labels]):
+        name = sample_name(source, key)
+        if image is None:
+            results.append((name, 'unreadable'))
+            continue
+        if image.dtype != np.uint8: # normalized frame dumps
+            image = (image * 255).astype(np.uint8) if image.max() <= 1.0 else image.astype(np.uint8)
+        face = _estimator.inspect(image)
+        if not face:
+            results.append((name, 'no_face'))
+            continue
+        face.gazepoint = gazepoints[key]
+        if face.eye_aspect_ratio() < MINIMUM_EAR: # gate before spending work on cropping
+            results.append((name, 'eyes_closed'))
+            continue
+        try:
+            face.fit(size=size, padding=padding, crop_eye=True)
+        except ValueError:
+            results.append((name, 'fit_error'))
+            continue
+        face.save(name, base=base)
+        results.append((name, 'saved'))
+    return results
+
+
+def build_tasks(sources, base, size, padding, chunk_size, done):
+    """Split every source into chunks of consecutive unprocessed frames, in a deterministic order"""
+    tasks = []
+    for source in sorted(sources):
+        labels = [label for label in read_labels(source) if sample_name(source, label[0]) not in done]
+        for start in range(0, len(labels), chunk_size):
+            tasks.append((source, labels[start:start + chunk_size], base, size, padding))
+    return tasks
+
+
+def main(sources, root='.', workers=None, chunk_size=64, size=(244, 244), padding=10):
+    prep_directory.main(root)
+    base = os.path.join(root, 'data')
+    log_path = os.path.join(base, PROGRESS_LOG)
+    done = set()
+    if os.path.exists(log_path): # Resume: skip frames finished by a previous run
+        with open(log_path) as file:
+            done = {line.split('\t')[0] for line in file if line.strip()}
+
+    tasks = build_tasks(sources, base, size, padding, chunk_size, done)
+    total = sum(len(task[1]) for task in tasks)
+    print(f"{total} frames to process ({len(done)} already done) on {workers or os.cpu_count()} workers")
+
+    counts = {}
+    processed = 0
+    start = time.perf_counter()
+    with mp.Pool(processes=workers, initializer=_init_worker) as pool, open(log_path, 'a') as log:
+        for results in pool.imap(_process_chunk, tasks): # imap keeps the progress log in task order
+            for name, status in results:
+                log.write(f'{name}\t{status}\n')
+                counts[status] = counts.get(status, 0) + 1
+            log.flush()
+            processed += len(results)
+            elapsed = time.perf_counter() - start
+            print(f"{processed}/{total} frames, {processed / elapsed:.1f} frames/s")
+
+    elapsed = time.perf_counter() - start
+    print(f"Done in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.1f} frames/s): {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reprocess recorded sessions into samples")
+    parser.add_argument('sources', nargs='+', help="video files or frame dump directories")
+    parser.add_argument('--root', default=os.getcwd(), help="project directory containing the data folder")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=64)
+    parser.add_argument('--size', type=int, nargs=2, default=(244, 244))
+    parser.add_argument('--padding', type=int, default=10)
+    args = parser.parse_args()
+    main(args.sources, args.root, args.workers, args.chunk_size, tuple(args.size), args.padding)
@@ -0,0 +1,49 @@
+"""
+Smoke test of the three-process pipeline on a short generated video.
+Skipped unless numpy, OpenCV, dlib and shape_predictor_68_face_landmarks.dat are available.
+"""
+import os
+import sys
+import time
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+pytest.importorskip('dlib')
+if not os.path.exists(os.path.join(ROOT, 'shape_predictor_68_face_landmarks.dat')):
+    pytest.skip('shape_predictor_68_face_landmarks.dat not found', allow_module_level=True)
+
+
+def _write_video(path, frames=30, size=(320, 240)):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, size)
+    rng = np.random.default_rng(0)
+    for _ in range(frames):
+        writer.write(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+    writer.release()
+
+
+def test_pipeline_processes_video(tmp_path, monkeypatch):
+    import prep_directory
+    from lib.pipeline import Pipeline
+
+    monkeypatch.chdir(ROOT) # the fit stage loads the landmark model from the working directory
+    video = str(tmp_path / 'session.avi')
+    _write_video(video)
+    base = str(tmp_path / 'data')
+    prep_directory.make_dirs(base)
+
+    pipeline = Pipeline(source=video, base=base).start()
+    deadline = time.monotonic() + 60.0
+    while time.monotonic() < deadline: # wait for the whole video to be captured (or a stage to die)
+        stats = pipeline.stats()
+        if stats['captured'] >= 30 or stats['failed_stages']:
+            break
+        time.sleep(0.2)
+    stats = pipeline.close(timeout=60.0) # queued frames drain through the later stages
+
+    assert stats['captured'] > 0
+    assert stats['processed'] == stats['captured'] - stats['dropped']
+    assert stats['failed_stages'] == {}